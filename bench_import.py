@@ -0,0 +1,43 @@
+"""
+Benchmark the time to 'import parson' in a fresh Python process.
+Usage: python bench_import.py [trials [max_ms]]
+With max_ms, exit with an error if the import takes longer than that.
+It also fails if importing builds things that should wait till used.
+"""
+
+import os, subprocess, sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+timer = """
+import time
+t = time.time()
+%s
+print (time.time() - t) * 1000
+"""
+
+def best_ms(statement, trials):
+    return min(float(subprocess.check_output([sys.executable, '-c', timer % statement],
+                                             cwd=here))
+               for _ in range(trials))
+
+laziness_check = """
+import sys, parson
+assert not isinstance(parson._grammar_grammar, parson._Peg), "grammar grammar built"
+assert 'len' not in parson._default_subs, "default subs built"
+assert 'mmap' not in sys.modules, "mmap imported"
+"""
+
+def main(argv):
+    trials = int(argv[1]) if 1 < len(argv) else 20
+    max_ms = float(argv[2]) if 2 < len(argv) else None
+    subprocess.check_call([sys.executable, '-c', laziness_check], cwd=here)
+    import_ms = best_ms('import parson', trials)
+    grammar_ms = best_ms('import parson; parson.Grammar("x = .")', trials)
+    print 'import parson:          %6.2f ms' % import_ms
+    print 'and then a Grammar():   %6.2f ms' % grammar_ms
+    if max_ms is not None and max_ms < import_ms:
+        sys.exit("Import took longer than %g ms" % max_ms)
+
+if __name__ == '__main__':
+    main(sys.argv)
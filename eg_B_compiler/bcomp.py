@@ -25,18 +25,17 @@ def compiler_main(filename, out_filename=None):
     try:
         global_decls = parser.program(text)
     except Unparsable as exc:
-        (before, after) = exc.failure
-        complain(filename, before, after, "Syntax error")
+        complain(filename, text, exc.position, exc.line, exc.column,
+                 "Syntax error")
         return 1
     gen_program(global_decls)
     return 0
 
-def complain(filename, before, after, plaint):
-    line_no = before.count('\n')
-    prefix = (before+'\n').splitlines()[line_no]
-    suffix = (after+'\n').splitlines()[0] # XXX what if right on newline?
-    prefix, suffix = sanitize(prefix), sanitize(suffix)
-    message = ["%s:%d:%d: %s" % (filename, line_no+1, len(prefix), plaint),
+def complain(filename, text, pos, line_no, column, plaint):
+    end = text.find('\n', pos)
+    prefix = sanitize(text[pos-column:pos])
+    suffix = sanitize(text[pos:] if end < 0 else text[pos:end])
+    message = ["%s:%d:%d: %s" % (filename, line_no, column, plaint),
                '  ' + prefix + suffix,
                '  ' + ' '*len(prefix) + '^']
     sys.stderr.write('\n'.join(message) + '\n')
@@ -15,11 +15,11 @@ parse = Grammar(r""" defn*.
 
 defn :  var '=' exp ';'  :hug.
 
-exp  :  "Choice"   args  :mk_choice
-     |  "Fixed"    args  :mk_fixed
-     |  "Sequence" args  :mk_sequence
-     |  "Shuffle"  args  :mk_shuffle
-     |  "Weighted" args  :mk_weighted
+exp  :  "Choice"   list  :mk_choice
+     |  "Fixed"    list  :mk_fixed
+     |  "Sequence" list  :mk_sequence
+     |  "Shuffle"  list  :mk_shuffle
+     |  "Weighted" list  :mk_weighted
      |  "Period"         :'.'
      |  "Comma"          :','
      |  "Semicolon"      :';'
@@ -31,7 +31,7 @@ exp  :  "Choice"   args  :mk_choice
      |  string
      |  int.
 
-args :  '(' exp ** ',' ')'.
+list :  '(' exp ** ',' ')'.
 
 var  :  /([A-Za-z_]\w*)/ :mk_var.
 
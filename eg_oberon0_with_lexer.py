@@ -101,7 +101,6 @@ lex_grammar = Grammar(lex_grammar_source)(Token = lambda s, kind=None: Token(kin
                                           keyword = match(r'(%s)\b' % a_keyword),
                                           punct   = match(r'(%s)' % a_literal))
 
-## import sys; sys.setrecursionlimit(5000)
 ## import glob
 ## from parson import exceptionally
 
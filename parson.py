@@ -2,26 +2,58 @@
 Parsing with PEGs.
 """
 
-import collections, re, types
+import array, bisect, collections, itertools, marshal, os, re, sre_constants, sre_parse, sys, time, types
+
+__version__ = '0.1.0dev'
+
+# (Not compile(), which would shadow the builtin: say parson.compile.)
+__all__ = ['Backtracking', 'Grammar', 'GrammarError', 'LineIndex', 'Peg',
+           'Profile', 'Spans', 'Unparsable', 'alter', 'anyone', 'capture',
+           'chain', 'delay', 'dynamic', 'either', 'empty', 'end',
+           'exceptionally', 'fail', 'feed', 'hug', 'invert', 'join', 'label',
+           'literal', 'lru', 'match', 'maybe', 'memo', 'nest', 'one_of',
+           'one_that', 'optimize', 'parts', 'plus', 'position', 'push',
+           'recur', 'seclude', 'star', 'trace', 'walk', 'word_boundary']
 
 # Glossary:
 #   peg     object representing a parsing expression
 #   p, q    peg
 #   s	    subject sequence. Usually a string, but only match() assumes that.
-#   i       position in subject sequence
-#   far     box holding the rightmost i reached so far
-#           (except during negative matching with invert())
-#   vals    values tuple
+#   i, j    position in subject sequence
+#   cx      the state of one parse, shared by the pegs it runs: in
+#           cx.far the rightmost i reached so far (except during
+#           negative matching with invert()), in cx.vals and cx.base
+#           the values (see below), and in cx.memos the memo tables
+#   far     (for run()) box holding far, and in far[1] the memo tables
+#   vals    values tuple, or (in cx.vals) values stack
 #   st      the state: an (i, vals) pair
 #   fn      function (not a peg)
 
-# A peg's run() function does the work. It takes (s, far, st) and
-# returns a list of states, of length 0 or 1: i.e. either [] or
-# [st]. (A more general kind of parser could return a list of any
-# number of states, enumerated lazily; but that'd change our model
-# both semantically (in (P|Q), Q can assume P didn't match) and in
-# performance. We use a list anyway because it's convenient to code
-# with list comprehensions.)
+# A peg also records how it was built: its op names the combinator
+# and its args are what the combinator was given (pegs and other
+# values), for the sake of analyses like compile(). An op of None
+# means we know nothing of its insides. See parts() and walk().
+
+# A peg's go() function does the work. It takes (s, i, cx) and returns
+# the new position, or -1 for failure, leaving the new values in
+# cx.vals. (After a failure cx.vals is garbage: whoever backtracks
+# restores it.) This way a match allocates nothing it doesn't have
+# to.
+
+# The values live on a stack of cons cells, (value, rest), with None
+# at the bottom, so that adding a value takes constant time and
+# backtracking just means going back to an older stack. The values
+# tuple a peg sees is the part of the stack above cx.base, which
+# seclude() sets; we only make that into a real tuple to call an
+# action like feed() or alter().
+
+# A peg also has a run() function, the older interface: it takes
+# (s, far, st) and returns a list of states, of length 0 or 1: i.e.
+# either [] or [st]. (A more general kind of parser could return a
+# list of any number of states, enumerated lazily; but that'd change
+# our model both semantically (in (P|Q), Q can assume P didn't match)
+# and in performance.) Either function can be made from the other, so
+# a peg can be defined with just a run().
 
 def Peg(x):
     """Make a peg from a Python value as appropriate for its type. For
@@ -49,10 +81,19 @@ def plus(p, separator=None):
 def star(p, separator=None):
     "Return a peg matching 0 or more of what p matches (maybe with separator)."
     if separator is None:
-        # p* = (p p*)?
-        # TODO custom implementation that won't chew up so many Python stack frames
-        return label(recur(lambda p_star: maybe(chain(p, p_star))), 
-                     '(%r)*', p)
+        # p* = (p p*)?, but as a loop, to not use up the Python stack.
+        def go(s, i, cx):
+            while True:
+                vals = cx.vals
+                j = p.go(s, i, cx)
+                if j < 0:
+                    cx.vals = vals
+                    return i
+                # If p matched without advancing, (p p*)? would recurse
+                # forever. We stop instead.
+                if j == i: return j
+                i = j
+        return _Peg(('(%r)*', p), None, 'star', (p,), go)
     else:
         # p**sep = (p (sep p)*)?
         return label(maybe(chain(p, star(chain(separator, p)))),
@@ -60,15 +101,26 @@ def star(p, separator=None):
 
 def invert(p):
     "Return a peg that succeeds just when p fails."
-    return _Peg(('!(%r)', p),
-                lambda s, far, st: [] if p.run(s, [0], st) else [st])
+    def go(s, i, cx):
+        far, vals = cx.far, cx.vals
+        j = p.go(s, i, cx)
+        cx.far, cx.vals = far, vals
+        return -1 if 0 <= j else i
+    return _Peg(('!(%r)', p), None, 'invert', (p,), go)
 
 class _Peg(object):
     """A parsing expression. It can match a prefix of a sequence,
     updating a values tuple in the process, or fail."""
-    def __init__(self, face, run):
+    # (Slots so that Grammar rules set as attributes can't clobber these;
+    # a grammar with a start rule can't name its other rules like them.)
+    __slots__ = ('face', 'run', 'go', 'op', 'args', 'target', 'first',
+                 '__dict__', '__weakref__')
+    def __init__(self, face, run, op=None, args=(), go=None):
         self.face = face
-        self.run = run
+        self.run = run or _run_from_go(self)
+        self.op = op
+        self.args = args
+        self.go = go or _go_from_run(self)
     def __repr__(self):
         if isinstance(self.face, (str, unicode)): return self.face
         if isinstance(self.face, tuple): return self.face[0] % self.face[1:]
@@ -76,16 +128,30 @@ class _Peg(object):
     def __call__(self, sequence):
         """Parse a prefix of sequence and return a tuple of values, or
         raise Unparsable."""
-        far = [0]
-        for _, vals in self.run(sequence, far, (0, ())):
-            return vals
-        raise Unparsable(self, sequence[:far[0]], sequence[far[0]:])
+        cx = _Parse()
+        if 0 <= self.go(sequence, 0, cx):
+            return _unwind(cx.vals, None)
+        raise Unparsable.at(self, sequence, cx.far)
     def attempt(self, sequence):
         "Parse a prefix of sequence and return a tuple of values or None."
-        try: return self(sequence)
-        except Unparsable: return None
+        # (Like __call__ but never making an Unparsable to throw away.)
+        cx = _Parse()
+        if 0 <= self.go(sequence, 0, cx):
+            return _unwind(cx.vals, None)
+        return None
+    def feeder(self, streaming=False):
+        """Return a push parser for self: feed() it the input a chunk at
+        a time, then close() it for the tuple of values. (See
+        pegvm.Feeder for streaming.)"""
+        import pegvm
+        return pegvm.Feeder(self, streaming=streaming)
+    def iterparse(self, sequence):
+        """Parse a prefix of sequence, yielding each value of our
+        outermost star() or plus() as soon as it's parsed."""
+        import pegvm
+        return pegvm.iterparse(self, sequence)
     def expecting_one_result(self):
-        return _OneResultPeg(self.face, self.run)
+        return _OneResultPeg(self.face, self.run, 'label', (self,), self.go)
     def __add__(self, other):  return chain(self, Peg(other))
     def __radd__(self, other): return chain(Peg(other), self)
     def __or__(self, other):   return either(self, Peg(other))
@@ -99,30 +165,173 @@ class _Peg(object):
     star = star
 
 class _OneResultPeg(_Peg):
+    __slots__ = ()
     def __call__(self, sequence):
-        result = super(_OneResultPeg, self).__call__(sequence)
-        assert len(result) == 1, "One result expected: %r" % (result,)
-        return result[0]
+        return _one_result(super(_OneResultPeg, self).__call__(sequence))
+    def attempt(self, sequence):
+        result = super(_OneResultPeg, self).attempt(sequence)
+        return None if result is None else _one_result(result)
+
+def _one_result(result):
+    assert len(result) == 1, "One result expected: %r" % (result,)
+    return result[0]
+
+class _Parse(object):
+    "The state of a parse in progress, shared by the pegs it runs."
+    __slots__ = ('far', 'vals', 'base', 'memos')
+    def __init__(self, far=0, vals=None, memos=None):
+        self.far = far
+        self.vals = vals
+        self.base = None
+        self.memos = {} if memos is None else memos
+
+def _unwind(vals, base):
+    "Return a tuple of the values on the stack vals above base."
+    if vals is base: return ()
+    value, vals = vals
+    if vals is base: return (value,)   # (The commonest cases go faster.)
+    result = [value]
+    while vals is not base:
+        value, vals = vals
+        result.append(value)
+    result.reverse()
+    return tuple(result)
+
+def _pushed(vals, values):
+    "Return the stack vals with values pushed onto it."
+    for value in values:
+        vals = value, vals
+    return vals
+
+def _run_from_go(p):
+    "Make a run() function for p out of its go()."
+    def run(s, far, (i, vals)):
+        if len(far) < 2: far.append({})
+        cx = _Parse(far[0], _pushed(None, vals), far[1])
+        j = p.go(s, i, cx)
+        far[0] = cx.far
+        return [(j, _unwind(cx.vals, None))] if 0 <= j else []
+    return run
+
+def _go_from_run(p):
+    "Make a go() function for p out of its run()."
+    def go(s, i, cx):
+        far = [cx.far, cx.memos]
+        sts = p.run(s, far, (i, _unwind(cx.vals, cx.base)))
+        cx.far = far[0]
+        if not sts: return -1
+        j, vals = sts[0]
+        cx.vals = _pushed(cx.base, vals)
+        return j
+    return go
 
 def _fn_name(fn):
     return fn.func_name if hasattr(fn, 'func_name') else repr(fn)
 
 class Unparsable(Exception):
-    "A parsing failure."
+    """A parsing failure, with args (peg, before, after): the input
+    split at the failure. Unparsable.at() makes one that puts off
+    splitting (and so copying) the input until someone asks."""
+    _subject, _position, _lines, _unsplit = None, None, None, False
+    _newlines, _line_start = 0, 0
+    @classmethod
+    def at(cls, peg, subject, far, offset=0, newlines=0, line_start=0):
+        """Return an Unparsable for peg failing at subject[far:], where
+        subject starts at offset in the whole input, and the input
+        before that held newlines newlines, the last ending at
+        line_start."""
+        e = cls(peg)
+        e._subject, e._far, e._position = subject, far, offset + far
+        if newlines: e._newlines, e._line_start = newlines, line_start
+        e._unsplit = True
+        return e
+    def _split(self):
+        if self._unsplit:
+            s, far = self._subject, self._far
+            self._unsplit = False
+            _exception_args.__set__(self, (_exception_args.__get__(self)
+                                           + (_slice(s, 0, far),
+                                              _slice(s, far, len(s)))))
+        return _exception_args.__get__(self)
+    @property
+    def args(self):
+        return self._split()
+    @args.setter
+    def args(self, args):
+        self._subject = self._position = self._lines = None
+        self._newlines = self._line_start = 0
+        self._unsplit = False
+        _exception_args.__set__(self, args)
+    # (Exception's own methods see only the args made so far.)
+    def __repr__(self):
+        self._split()
+        return Exception.__repr__(self)
+    def __str__(self):
+        self._split()
+        return Exception.__str__(self)
+    def __getitem__(self, index):
+        return self._split()[index]
     @property
     def position(self):
         "The rightmost position positively reached in the parse attempt."
+        if self._position is not None: return self._position
         return len(self.args[1])
     @property
     def failure(self):  # XXX rename?
-        "Return slices of the input before and after the parse failure."
+        """Return slices of the input before and after the parse failure.
+        (For a Feeder's, the input before starts at offset.)"""
         return self.args[1], self.args[2]
+    @property
+    def offset(self):
+        """How much input came before failure[0], that the parse let go
+        of: so position == offset + len(failure[0])."""
+        if self._position is None: return 0
+        return self._position - self._far
+    @property
+    def line(self):
+        "The line number, from 1, of the failure's position."
+        return self._locate()[0]
+    @property
+    def column(self):
+        "The column, from 0, of the failure's position in its line."
+        return self._locate()[1]
+    def _locate(self):
+        if self._lines is None:
+            if self._subject is None:
+                self._subject = self.args[1]
+                self._far = len(self._subject)
+            self._lines = LineIndex(self._subject)
+        line, column = self._lines.locate(self._far)
+        if line == 1:           # (Its start may be in the input before.)
+            column = self.position - self._line_start
+        return self._newlines + line, column
+
+class LineIndex(object):
+    """The line and column of each position in a text, found by binary
+    search. Lines count from 1 and columns from 0. Make one per text,
+    and reuse it: making it takes a pass over the text."""
+    def __init__(self, text):
+        self.text = text
+        self.starts = [0]
+        self.starts.extend(m.end() for m in re.finditer('\n', text))
+    def locate(self, position):
+        "Return (line, column) of position."
+        line = bisect.bisect_right(self.starts, position)
+        return line, position - self.starts[line-1]
+    def bounds(self, line):
+        """Return (start, end) positions of line in the text, not
+        counting its newline."""
+        start = self.starts[line-1]
+        if line < len(self.starts): return start, self.starts[line] - 1
+        return start, len(self.text)
+
+_exception_args = BaseException.__dict__['args']
 
 def label(p, string, *args):
     """Return an equivalent peg whose repr is (string % args), or just
     string if no args."""
     return _Peg(((string,) + args if args else string),
-                p.run)
+                p.run, 'label', (p,), p.go)
 
 def recur(fn):
     "Return a peg p such that p = fn(p). This is like the Y combinator."
@@ -135,22 +344,54 @@ def delay(thunk, *face):        # XXX document face
     only once, and not until the first use of q. Use this for
     recursive grammars."""
     def run(s, far, st):
-        q.run = Peg(thunk()).run
+        force()
         return q.run(s, far, st)
+    def go(s, i, cx):
+        force()
+        return q.go(s, i, cx)
+    def force():
+        p = _forced(q)
+        q.run, q.go = p.run, p.go
     q = _Peg(face or ('delay(%s)', _fn_name(thunk)),
-             run)
+             run, 'delay', (thunk,), go)
     return q
 
+def _forced(q):
+    "Return the peg that the delay() q stands for."
+    try:
+        return q.target
+    except AttributeError:
+        q.target = Peg(q.args[0]())
+        return q.target
+
 # TODO: need doc comments or something
-fail  = _Peg('fail', lambda s, far, st: [])
+fail  = _Peg('fail', None, 'fail', (), lambda s, i, cx: -1)
 empty = label(~fail, 'empty')
-             
-position = _Peg('position', lambda s, far, (i, vals): [(i, vals + (i,))])
-                
+
+def _position(s, i, cx):
+    cx.vals = i, cx.vals
+    return i
+position = _Peg('position', None, 'position', (), _position)
+
 def literal(string):
     "Return a peg that matches string exactly."
-    return label(match(re.escape(string)),
-                 'literal(%r)', string)
+    if _high_bytes(string):
+        go = match(re.escape(string)).go
+        return _Peg(('literal(%r)', string), None, 'literal', (string,), go)
+    n = len(string)
+    def go(s, i, cx):
+        # (Slicing works for any subject, and beats s.startswith().)
+        j = i + n
+        if s[i:j] != string: return -1
+        if cx.far < j: cx.far = j
+        return j
+    return _Peg(('literal(%r)', string), None, 'literal', (string,), go)
+
+def _high_bytes(string):
+    """Is string a str with bytes past ASCII? Those match a unicode
+    subject's chars by their Latin-1 codes, as in a regex, so a slice
+    comparing unequal won't do."""
+    return isinstance(string, str) and not all(c < '\x80' for c in string)
 
 def match(regex):
     """Return a peg that matches what regex does, adding any captures
@@ -158,78 +399,167 @@ def match(regex):
     # XXX Alas, Python's re has quirks: e.g. a|aa matches just 'a' out of 'aa'.
     #     This makes this construction unsuitable for a portable grammar language.
     compiled = re.compile(regex)
-    return _Peg(('/%s/', regex),
-                lambda s, far, (i, vals):
-                    [(_step(far, m.end()), vals + m.groups())
-                     for m in [compiled.match(s, i)] if m])
-
-def _step(far, i):
-    "Update far with a new position."
-    far[0] = max(far[0], i)
-    return i
+    def go(s, i, cx):
+        m = compiled.match(s, i)
+        if m is None: return -1
+        i = m.end()
+        if cx.far < i: cx.far = i
+        if compiled.groups: cx.vals = _pushed(cx.vals, m.groups())
+        return i
+    return _Peg(('/%s/', regex), None, 'match', (regex,), go)
 
 def capture(p):
     """Return a peg that acts like p, except it adds to the values
     tuple the text that p matched."""
-    return _Peg(('capture(%r)', p),
-                lambda s, far, (i, vals):
-                    [(i2, vals2 + (s[i:i2],))
-                     for i2, vals2 in p.run(s, far, (i, vals))])
+    def go(s, i, cx):
+        j = p.go(s, i, cx)
+        if 0 <= j: cx.vals = _slice(s, i, j), cx.vals
+        return j
+    return _Peg(('capture(%r)', p), None, 'capture', (p,), go)
+
+def _slice(s, i, j):
+    """Return s[i:j] -- but for a memory map or buffer, a buffer onto
+    it, so that parsing a big file needn't copy it. (A memoryview's
+    slices are views already.)"""
+    if type(s) in _copied: return s[i:j]
+    if type(s) is buffer or _is_mmap(s): return buffer(s, i, j - i)
+    return s[i:j]
+
+_copied = (str, unicode, list, tuple)
+
+def _is_mmap(s):
+    import mmap                 # (Here, so importing parson needn't.)
+    return type(s) is mmap.mmap
 
 def seclude(p):
     """Return a peg like p, but where p doesn't get to see or alter
     the incoming values tuple."""
-    return _Peg(('[%r]', p),
-                lambda s, far, (i, vals):
-                    [(i2, vals + vals2)
-                     for i2, vals2 in p.run(s, far, (i, ()))])
+    def go(s, i, cx):
+        base = cx.base
+        cx.base = cx.vals
+        j = p.go(s, i, cx)
+        cx.base = base
+        return j
+    return _Peg(('[%r]', p), None, 'seclude', (p,), go)
 
 def either(p, q):
     """Return a peg that succeeds just when one of p or q does, trying
     them in that order."""
-    return _Peg(('(%r|%r)', p, q),
-                lambda s, far, st:
-                    p.run(s, far, st) or q.run(s, far, st))
+    def first_go(s, i, cx):
+        # On first use, see if we can do better by looking ahead.
+        if r.go is first_go: _settle(r)
+        return r.go(s, i, cx)
+    r = _Peg(('(%r|%r)', p, q), None, 'either', (p, q), first_go)
+    return r
+
+def _settle(r):
+    "Give the either() r its go() for good."
+    r.go = _dispatcher(r) or _either_go(*r.args)
+
+def _either_go(p, q):
+    def go(s, i, cx):
+        vals = cx.vals
+        j = p.go(s, i, cx)
+        if 0 <= j: return j
+        cx.vals = vals
+        return q.go(s, i, cx)
+    return go
 
 def chain(p, q):
     """Return a peg that succeeds when p and q both do, with q
     starting where p left off."""
-    return _Peg(('(%r %r)', p, q),
-                lambda s, far, st:
-                    [st3 
-                     for st2 in p.run(s, far, st)
-                     for st3 in q.run(s, far, st2)])
+    def go(s, i, cx):
+        j = p.go(s, i, cx)
+        return j if j < 0 else q.go(s, j, cx)
+    return _Peg(('(%r %r)', p, q), None, 'chain', (p, q), go)
 
 def alter(fn):                  # XXX better name
     """Return a peg that always succeeds, changing the values tuple
     from xs to fn(*xs)."""
-    return _Peg(('alter(%s)', _fn_name(fn)),
-                lambda s, far, (i, vals): [(i, fn(*vals))])  # XXX check that result is tuple?
+    def go(s, i, cx):
+        cx.vals = _pushed(cx.base, fn(*_unwind(cx.vals, cx.base)))  # XXX check that result is tuple?
+        return i
+    return _Peg(('alter(%s)', _fn_name(fn)), None, 'alter', (fn,), go)
 
 def feed(fn):
     """Return a peg that always succeeds, changing the values tuple
     from xs to (fn(*xs),). (We're feeding fn with the values.)"""
-    return label(alter(lambda *vals: (fn(*vals),)),
-                 ':%s', _fn_name(fn))
+    def go(s, i, cx):
+        cx.vals = fn(*_unwind(cx.vals, cx.base)), cx.base
+        return i
+    return _Peg((':%s', _fn_name(fn)), None, 'feed', (fn,), go)
 
 def push(c):
-    return label(alter(lambda *xs: xs + (c,)),
-                 'push(%r)' % (c,),)
+    def go(s, i, cx):
+        cx.vals = c, cx.vals
+        return i
+    return _Peg('push(%r)' % (c,), None, 'push', (c,), go)
                  
+def memo(p, table=dict):
+    """Return a peg like p, but remembering its result at each position
+    (packrat parsing). The memo table lasts just for one parse; table()
+    makes it, so pass e.g. lru(10000) to keep it bounded."""
+    def go(s, i, cx):
+        memos = _memo_table(cx, q, table)
+        vals, base, far = cx.vals, cx.base, cx.far
+        entry = memos.get(i)
+        # An entry is only good for the same incoming values. Alternatives
+        # of an either() share them, so that's the case that matters.
+        if entry is None or entry[0] is not vals or entry[1] is not base:
+            cx.far = 0
+            j = p.go(s, i, cx)
+            entry = vals, base, j, cx.vals, cx.far
+            memos[i] = entry
+        _, _, j, cx.vals, sub_far = entry
+        cx.far = max(far, sub_far)
+        return j
+    q = _Peg(('memo(%r)', p), None, 'memo', (p, table), go)
+    return q
+
+def _memo_table(cx, q, table):
+    "Find or make q's memo table for the current parse."
+    try:
+        return cx.memos[q]
+    except KeyError:
+        cx.memos[q] = result = table()
+        return result
+
+def lru(size):
+    """Make memo tables for memo() that keep only the size
+    most-recently-used entries."""
+    return lambda: _LRUTable(size)
+
+class _LRUTable(collections.OrderedDict):
+    def __init__(self, size):
+        collections.OrderedDict.__init__(self)
+        self.size = size
+    def get(self, key):
+        try: value = self.pop(key)
+        except KeyError: return None
+        self[key] = value
+        return value
+    def __setitem__(self, key, value):
+        if key not in self and self.size <= len(self):
+            self.popitem(last=False)
+        collections.OrderedDict.__setitem__(self, key, value)
+
 def dynamic(fn):
     """Pop the values and pass them to fn, which must return a peg to
     continue the match with. This serves about the same purpose as
     monadic bind in other parser-combinator libraries."""
-    return _Peg('dynamic',
-                lambda s, far, (i, vals): fn(*vals).run(s, far, (i, ())))
+    def go(s, i, cx):
+        p = fn(*_unwind(cx.vals, cx.base))
+        cx.vals = cx.base
+        return p.go(s, i, cx)
+    return _Peg('dynamic', None, 'dynamic', (fn,), go)
 
 def trace(message):
     "A peg that succeeds, and says so."
     # TODO: better debugging means
-    def tracer(s, far, (i, vals)):
-        print message, i, vals
-        return [(i, vals)]
-    return _Peg('trace', tracer)
+    def tracer(s, i, cx):
+        print message, i, _unwind(cx.vals, cx.base)
+        return i
+    return _Peg('trace', None, 'trace', (message,), tracer)
 
 
 # Some often-useful actions for feed().
@@ -250,16 +580,19 @@ def one_that(ok):
     exists and if ok(x). It leaves the values tuple unchanged.
     (N.B. the input can be a non-string: anything accessible by
     index.)"""
-    def run(s, far, (i, vals)):
+    def go(s, i, cx):
         try: item = s[i]
-        except IndexError: return []
-        return [(_step(far, i+1), vals)] if ok(item) else []
-    return _Peg(('one_that(%s)', _fn_name(ok)), run)
+        except IndexError: return -1
+        if not ok(item): return -1
+        i += 1
+        if cx.far < i: cx.far = i
+        return i
+    return _Peg(('one_that(%s)', _fn_name(ok)), None, 'one_that', (ok,), go)
 
 def one_of(item):
     "Return a peg that eats one element equal to the argument."
-    return label(one_that(lambda x: item == x),
-                 'one_of(%r)', item)
+    p = one_that(lambda x: item == x)
+    return _Peg(('one_of(%r)', item), None, 'one_of', (item,), p.go)
 
 anyone = label(one_that(lambda x: True), 'anyone')
 end = label(~anyone, 'end')
@@ -269,13 +602,19 @@ end = label(~anyone, 'end')
 
 def nest(p):
     "Return a peg that eats one item, a sequence that p eats a prefix of."
-    def run(s, far, (i, vals)):
+    def go(s, i, cx):
         try: item = s[i]
-        except IndexError: return []
-        if not _is_indexable(item): return []
-        return [(_step(far, i+1), vals1)
-                for _, vals1 in p.run(item, [0], (0, vals))]
-    return _Peg(('nest(%r)', p), run)
+        except IndexError: return -1
+        if not _is_indexable(item): return -1
+        far, memos = cx.far, cx.memos
+        cx.far, cx.memos = 0, {}
+        j = p.go(item, 0, cx)
+        cx.far, cx.memos = far, memos
+        if j < 0: return -1
+        i += 1
+        if cx.far < i: cx.far = i
+        return i
+    return _Peg(('nest(%r)', p), None, 'nest', (p,), go)
 
 def _is_indexable(x):
     try: x[0]
@@ -289,6 +628,792 @@ def _is_indexable(x):
 #. ()
 
 
+# Looking inside pegs, for analyses and other backends.
+
+def parts(peg):
+    """Return (op, children, params) for how peg was built: the name
+    of its combinator, the pegs it was built from, and the other
+    arguments, like a regex or an action function. A delay()'s child
+    is the peg it stands for, once we can know that."""
+    if peg.op == 'delay':
+        target = _forced_if_ready(peg)
+        return peg.op, (() if target is None else (target,)), ()
+    return (peg.op,
+            tuple(x for x in peg.args if isinstance(x, _Peg)),
+            tuple(x for x in peg.args if not isinstance(x, _Peg)))
+
+def walk(peg):
+    "Generate peg and each peg it's built from, each just once."
+    seen, agenda = set(), [peg]
+    while agenda:
+        p = agenda.pop()
+        if p not in seen:
+            seen.add(p)
+            yield p
+            agenda.extend(reversed(parts(p)[1]))
+
+
+# Analysis: what can a peg's match start with? _first(p) returns a
+# pair (chars, nullable): p can succeed without consuming any input
+# only if nullable, and otherwise only when the next item of the
+# subject is in the set chars. A chars of None means we can't tell.
+
+def _first(p):
+    try:
+        return p.first
+    except AttributeError:
+        p.first = None, True    # Meanwhile, in case of a cycle.
+        p.first = result = _compute_first(p)
+        return result
+
+def _compute_first(p):
+    op = p.op
+    if op in ('label', 'capture', 'seclude', 'memo', 'fed', 'profiled', 'watched'):
+        return _first(p.args[0])
+    if op == 'fused':
+        return _first(p.args[1])
+    if op == 'delay':
+        q = _forced_if_ready(p)
+        return (None, True) if q is None else _first(q)
+    if op == 'chain':
+        chars, nullable = set(), True
+        for q in _flatten('chain', p):
+            q_chars, nullable = _first(q)
+            chars = _union(chars, q_chars)
+            if not nullable: break
+        return chars, nullable
+    if op == 'either':
+        chars, nullable = set(), False
+        for q in _flatten('either', p):
+            q_chars, q_nullable = _first(q)
+            chars, nullable = _union(chars, q_chars), nullable or q_nullable
+        return chars, nullable
+    if op == 'star':
+        return _first(p.args[0])[0], True
+    if op in ('invert', 'alter', 'feed', 'push', 'position', 'trace'):
+        return set(), True
+    if op == 'fail':
+        return set(), False
+    if op == 'literal':
+        string = p.args[0]
+        if string == '': return set(), True
+        return (None if _high_bytes(string[0]) else set([string[0]])), False
+    if op == 'match':
+        return _regex_first(p.args[0])
+    if op == 'one_of':
+        try: return set([p.args[0]]), False
+        except TypeError: return None, False
+    if op in ('one_that', 'nest'):
+        return None, False
+    return None, True
+
+def _union(chars1, chars2):
+    return None if chars1 is None or chars2 is None else chars1 | chars2
+
+def _regex_first(regex):
+    parsed = sre_parse.parse(regex)
+    nullable = parsed.getwidth()[0] == 0
+    if parsed.pattern.flags & (re.IGNORECASE | re.LOCALE | re.UNICODE):
+        return None, nullable
+    return _sre_first(parsed.data), nullable
+
+def _sre_first(items):
+    "Return the first chars of a parsed regex sequence, or None."
+    chars = set()
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            return _union(chars, _sre_set([(op, av)]))
+        elif op == sre_constants.IN:
+            return _union(chars, _sre_set(av))
+        elif op == sre_constants.SUBPATTERN:
+            return _union(chars, _sre_first(av[-1]))
+        elif op == sre_constants.BRANCH:
+            for alternative in av[1]:
+                chars = _union(chars, _sre_first(alternative))
+            return chars
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            lo, _, body = av
+            chars = _union(chars, _sre_first(body))
+            if 0 < lo: return chars
+        elif op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            continue            # Zero-width: it can only restrict.
+        else:
+            return None
+        if chars is None: return None
+    return None                 # Nullable, so anything can follow.
+
+def _sre_char(code):
+    "Return the subject item a regex's code matches, or None if it depends."
+    # From 128 to 255 that's chr(code) in a str, unichr(code) in a unicode
+    # subject, and the two don't compare equal (nor quietly).
+    if code < 128: return chr(code)
+    if 256 <= code: return unichr(code)
+    return None
+
+def _sre_set(items):
+    chars = set()
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            chars.add(_sre_char(av))
+        elif op == sre_constants.RANGE and av[1] - av[0] < 256:
+            chars.update(map(_sre_char, range(av[0], av[1]+1)))
+        elif op == sre_constants.CATEGORY and av in _category_chars:
+            chars.update(_category_chars[av])
+        else:
+            return None
+    return None if None in chars else chars
+
+_digits = '0123456789'
+_letters = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_category_chars = {sre_constants.CATEGORY_DIGIT: _digits,
+                   sre_constants.CATEGORY_SPACE: ' \t\n\r\f\v',
+                   sre_constants.CATEGORY_WORD: _letters + _digits + '_'}
+
+def _flatten(op, p):
+    "List the operands of nested binary op's in p, like (q|(r|s)) => [q,r,s]."
+    result = []
+    while True:
+        q = p
+        while q.op == 'label': q = q.args[0]
+        if q.op != op: return result + [p]
+        result.append(q.args[0])
+        p = q.args[1]
+
+def _dispatcher(p):
+    """Return a go() function for the either() p that looks at the next
+    item of the subject to skip the alternatives that can't match it;
+    or None if that wouldn't help."""
+    alts = _flatten('either', p)
+    firsts = map(_first, alts)
+    always = [chars is None or nullable for chars, nullable in firsts]
+    if all(always): return None
+    keys = set().union(*[chars for (chars, _), a in zip(firsts, always) if not a])
+    table = {key: tuple(q for q, (chars, _), a in zip(alts, firsts, always)
+                        if a or key in chars)
+             for key in keys}
+    default = tuple(q for q, a in zip(alts, always) if a)
+    at_end = tuple(q for q, (_, nullable) in zip(alts, firsts) if nullable)
+    def go(s, i, cx):
+        try:
+            options = table.get(s[i], default)
+        except IndexError:
+            options = at_end
+        except TypeError:       # An unhashable item
+            options = default
+        vals = cx.vals
+        for q in options:
+            j = q.go(s, i, cx)
+            if 0 <= j: return j
+            cx.vals = vals
+        return -1
+    return go
+
+
+# Fusing regex-like pegs: a run like '(' FNORD in a grammar costs a
+# call per literal, match, and delay along the way. Where the run
+# captures nothing we can instead match one regex that does the same.
+# This has to match just as the pegs would: taking the first way a
+# regex finds, without backtracking into it (see _atomic()), and
+# leaving cx.far where they would. On failure we rerun the original
+# pegs, to get cx.far right there too.
+
+def _fused(p):
+    "Return a peg equivalent to p, with runs of regex-like pegs fused."
+    return _Fuser().fused(p)
+
+class _Fuser(object):
+
+    def __init__(self, rules=None):
+        self.rules = rules      # A grammar's rules, by name, or None.
+        # These are keyed by id(peg), with the peg in the value to keep it alive.
+        self.done = {}          # peg -> its fused version
+        self.forms = {}         # peg -> its regex_form()
+
+    def fused(self, p):
+        if id(p) not in self.done:
+            self.done[id(p)] = p, self.fuse(p)
+        return self.done[id(p)][1]
+
+    def fuse(self, p):
+        q = p
+        while q.op in ('label', 'seclude'): q = q.args[0]
+        if q.op in ('chain', 'either', 'star'):
+            form = self.regex_form(p)
+            if form is not None:
+                return _fused_peg(form[0], p) or p
+        if p.op == 'chain':
+            parts = self.fuse_runs(_flatten('chain', p), chain, lambda forms: True)
+            return p if parts is None else _rebuilt_binary(p, chain, parts)
+        if p.op == 'either':
+            # Alternatives before the chosen one must leave cx.far alone.
+            ok = lambda forms: all(form[1] for form in forms[:-1])
+            alts = self.fuse_runs(_flatten('either', p), either, ok)
+            return p if alts is None else _rebuilt_binary(p, either, alts)
+        if p.op in _fusable_kid_ops:
+            kid = self.fused(p.args[0])
+            if kid is p.args[0]: return p
+            if p.op == 'label': return label(kid, p.face)
+            q = _fusable_kid_ops[p.op](kid, *p.args[1:])
+            q.face = p.face
+            return q
+        return p
+
+    def fuse_runs(self, pegs, combine, ok):
+        """Fuse each run of 2 or more regex-like pegs that ok() accepts
+        the forms of, and fuse inside the rest. Return the new list of
+        pegs, or None if nothing changed."""
+        result, run = [], []
+        def flush():
+            if 1 < len(run) and ok([form for _, form in run]):
+                original = _rebuilt_binary(None, combine, [q for q, _ in run])
+                regex = _concatenated([form for _, form in run]) if combine is chain \
+                        else '|'.join(form[0] for _, form in run)
+                result.append(_fused_peg(regex, original) or original)
+            else:
+                result.extend(self.fused(q) for q, _ in run)
+            del run[:]
+        for q in pegs:
+            form = self.regex_form(q)
+            if form is None:
+                flush()
+                result.append(self.fused(q))
+            else:
+                run.append((q, form))
+        flush()
+        if len(pegs) == len(result) and all(q is r for q, r in zip(pegs, result)):
+            return None
+        return result
+
+    def regex_form(self, p):
+        """Return (regex, clean, lo, hi) where regex matches just what
+        p does, with no values, in from lo to hi chars; or else None.
+        clean means a failure leaves cx.far alone. (Success always
+        leaves it at the end of the match, for these.)"""
+        if id(p) not in self.forms:
+            self.forms[id(p)] = p, None     # Meanwhile, in case of a cycle.
+            self.forms[id(p)] = p, self.make_regex_form(p)
+        return self.forms[id(p)][1]
+
+    def make_regex_form(self, p):
+        while p.op in ('label', 'seclude'): p = p.args[0]
+        op = p.op
+        if op == 'delay':
+            q = _peeked(p, self.rules)
+            return None if q is None else self.regex_form(q)
+        if op == 'fused':
+            return self.regex_form(p.args[1])
+        if op == 'literal':
+            n = len(p.args[0])
+            return re.escape(p.args[0]), True, n, n
+        if op == 'match':
+            regex = p.args[0]
+            parsed = sre_parse.parse(regex)
+            if re.compile(regex).groups or parsed.pattern.flags: return None
+            lo, hi = parsed.getwidth()
+            return '(?:%s)' % regex, True, lo, hi
+        if op == 'fail':
+            return '(?!)', True, 0, 0
+        if op == 'invert':
+            form = self.regex_form(p.args[0])
+            if form is None: return None
+            return ('' if form[0] == '(?!)' else '(?!%s)' % form[0]), True, 0, 0
+        if op == 'star':
+            form = self.regex_form(p.args[0])
+            if form is None or not form[1]: return None
+            hi = 0 if form[3] == 0 else _unbounded
+            return '(?:%s)*' % _atomic(form), True, 0, hi
+        if op == 'chain':
+            forms = map(self.regex_form, _chain_parts(p))
+            if None in forms: return None
+            # A failure after a part that advanced has already moved cx.far.
+            clean = all(f[1] for f in forms) and all(f[3] == 0 for f in forms[:-1])
+            return (_concatenated(forms), clean,
+                    sum(f[2] for f in forms), min(_unbounded, sum(f[3] for f in forms)))
+        if op == 'either':
+            alts = _flatten('either', p)
+            forms = map(self.regex_form, alts)
+            if None in forms or not all(f[1] for f in forms[:-1]): return None
+            clean = forms[-1][1]
+            lo, hi = min(f[2] for f in forms), max(f[3] for f in forms)
+            if all(q.op == 'literal' and len(q.args[0]) == 1 for q in alts):
+                return '[%s]' % ''.join(f[0] for f in forms), clean, lo, hi
+            return '(?:%s)' % '|'.join(f[0] for f in forms), clean, lo, hi
+        return None
+
+_fusable_kid_ops = {'label': label, 'seclude': seclude, 'capture': capture,
+                    'invert': invert, 'star': star, 'memo': memo, 'nest': nest,
+                    'fed': lambda p, fn: _fed(p, fn)}
+
+def _chain_parts(p):
+    "List the pegs in sequence in the chain p, however it's nested."
+    while p.op == 'label': p = p.args[0]
+    if p.op != 'chain': return [p]
+    return _chain_parts(p.args[0]) + _chain_parts(p.args[1])
+
+def _rebuilt_binary(p, combine, pegs):
+    "Combine pegs from the right, like (a|(b|c)), with p's face if any."
+    q = reduce(lambda q, r: combine(r, q), reversed(pegs))
+    if p is not None: q.face = p.face
+    return q
+
+def _fused_peg(regex, p):
+    "Return a peg like p, given a regex matching just like it; or None."
+    try:
+        compiled = re.compile(_named_groups(regex))
+    except (re.error, AssertionError, OverflowError): # E.g. too many groups
+        return None
+    def go(s, i, cx):
+        m = compiled.match(s, i)
+        if m is None: return p.go(s, i, cx)
+        i = m.end()
+        if cx.far < i: cx.far = i
+        return i
+    return _Peg(p.face, None, 'fused', (regex, p), go)
+
+def _concatenated(forms):
+    "Return a regex for the regex forms in sequence."
+    return ''.join(map(_atomic, forms[:-1])) + forms[-1][0]
+
+def _atomic((regex, _, lo, hi)):
+    """Return a regex that matches the way regex would on its own, with
+    no later backtracking into it. (Lookahead doesn't backtrack. If
+    regex can only match one length, from lo to hi, backtracking can't
+    matter.) The group names get filled in by _named_groups()."""
+    if lo == hi: return regex
+    return '(?=(?P<@>%s))(?P=@)' % regex
+
+def _named_groups(regex):
+    "Give distinct names to the groups _atomic() made."
+    names, stack = itertools.count(), []
+    def name(m):
+        if m.group() == '(?P<@>':
+            stack.append('_%d' % next(names))
+            return '(?P<%s>' % stack[-1]
+        return '(?P=%s)' % stack.pop()
+    return re.sub(r'\(\?P<@>|\(\?P=@\)', name, regex)
+
+_unbounded = sre_constants.MAXREPEAT
+
+def _peeked(p, rules):
+    """Return the peg the delay() p stands for, if we can tell yet,
+    without forcing p: if it's been forced already, or it refers to
+    one of a grammar's rules. (Forcing would fix p's peg for good,
+    and a rule's is still to be fused, memoized, and so on.)"""
+    try:
+        return p.target
+    except AttributeError:
+        pass
+    name = getattr(p, 'rule', None)
+    if rules is None or name not in rules: return None
+    return rules[name]
+
+
+# Peephole optimization: rewrite redundant shapes that combinators
+# and grammars tend to build, like (empty + p) or [[p]], into simpler
+# equivalents.
+
+def optimize(peg, counts=None):
+    """Return a peg equivalent to peg but simpler to run. If counts is
+    a dict, count in it each kind of rewrite we made."""
+    optimizer = _Optimizer(counts)
+    result = optimizer.optimized(peg)
+    optimizer.finish()
+    _link([result])
+    return result
+
+class _Optimizer(object):
+
+    def __init__(self, counts):
+        self.counts = counts
+        self.done = {}          # id(peg) -> (peg, its optimized version)
+        self.pending = []       # (target of a delay, box for its optimized version)
+
+    def optimized(self, p):
+        if id(p) not in self.done:
+            if p.op == 'delay':
+                self.done[id(p)] = p, self.optimized_delay(p)
+            else:
+                self.done[id(p)] = p, self.optimize(p)
+        return self.done[id(p)][1]
+
+    def optimized_delay(self, p):
+        target = _forced_if_ready(p)
+        if target is None: return p
+        box = []
+        self.pending.append((target, box))
+        return delay(lambda: box[0], *(p.face if isinstance(p.face, tuple) else (p.face,)))
+
+    def finish(self):
+        "Optimize what the delays we met stand for."
+        while self.pending:
+            target, box = self.pending.pop()
+            box.append(self.optimized(target))
+
+    def note(self, rewrite, result):
+        if self.counts is not None:
+            self.counts[rewrite] = self.counts.get(rewrite, 0) + 1
+        return result
+
+    def optimize(self, p):
+        op = p.op
+        if op not in _optimizer_rebuilders: return p
+        kids = [self.optimized(q) if isinstance(q, _Peg) else q for q in p.args]
+        if op == 'label':
+            q = kids[0]
+            if q.op == 'label':
+                return self.note('label(label(p)) => label(p)', label(q.args[0], p.face))
+        elif op == 'chain':
+            q, r = kids
+            if _is_empty(q): return self.note('empty + p => p', r)
+            if _is_empty(r): return self.note('p + empty => p', q)
+            if _is_fail(q):  return self.note('fail + p => fail', q)
+        elif op == 'either':
+            q, r = kids
+            if _is_fail(q):    return self.note('fail | p => p', r)
+            if _is_fail(r):    return self.note('p | fail => p', q)
+            if _never_fails(q): return self.note('p | q => p, when p never fails', q)
+        elif op == 'seclude':
+            q = _unlabeled(kids[0])
+            if q.op in ('seclude', 'fed'): return self.note('[[p]] => [p]', kids[0])
+            if _is_valueless(q): return self.note('[p] => p, when p has no values', kids[0])
+            if q.op == 'chain':
+                parts = _chain_parts(q)
+                if _unlabeled(parts[-1]).op == 'feed':
+                    fn = _unlabeled(parts[-1]).args[0]
+                    rest = _rebuilt_binary(None, chain, parts[:-1]) if 1 < len(parts) else empty
+                    return self.note('[p :fn] => fed(p, fn)', _fed(rest, fn))
+        elif op == 'star':
+            q = kids[0]
+            if _is_fail(q) or _is_empty(q): return self.note('fail* or empty* => empty', empty)
+        elif op == 'capture':
+            if _is_fail(kids[0]): return self.note('{fail} => fail', kids[0])
+        if all(q is r for q, r in zip(kids, p.args)): return p
+        if op == 'label': return label(kids[0], p.face)
+        return _optimizer_rebuilders[op](*kids)
+
+def _fed(p, fn):
+    """Return a peg like [p :fn], as one step: run p in a fresh values
+    tuple, then replace those values by fn(*values)."""
+    def go(s, i, cx):
+        base = cx.base
+        cx.base = cx.vals
+        j = p.go(s, i, cx)
+        if 0 <= j: cx.vals = fn(*_unwind(cx.vals, cx.base)), cx.base
+        cx.base = base
+        return j
+    return _Peg(('[%r :%s]', p, _fn_name(fn)), None, 'fed', (p, fn), go)
+
+_optimizer_rebuilders = {'label': label, 'chain': chain, 'either': either,
+                         'seclude': seclude, 'capture': capture, 'invert': invert,
+                         'star': star, 'memo': memo, 'nest': nest, 'fed': _fed}
+
+def _unlabeled(p):
+    while p.op == 'label': p = p.args[0]
+    return p
+
+def _is_fail(p):
+    return _unlabeled(p).op == 'fail'
+
+def _is_empty(p):
+    p = _unlabeled(p)
+    return p.op == 'invert' and _is_fail(p.args[0])
+
+def _never_fails(p):
+    p = _unlabeled(p)
+    if p.op in ('star', 'position', 'push', 'alter', 'feed'): return True
+    if p.op == 'either': return _never_fails(p.args[1])
+    if p.op == 'chain': return all(map(_never_fails, p.args))
+    if p.op == 'seclude': return _never_fails(p.args[0])
+    return _is_empty(p)
+
+def _is_valueless(p):
+    "Does p neither look at nor change the values?"
+    p = _unlabeled(p)
+    if p.op in ('literal', 'fail'): return True
+    if p.op == 'match': return re.compile(p.args[0]).groups == 0
+    if p.op == 'fused': return True
+    if p.op in ('chain', 'either'): return all(map(_is_valueless, p.args))
+    if p.op in ('invert', 'star'): return _is_valueless(p.args[0])
+    return False
+
+
+# Compile pegs to Python source, one function per rule. A generated
+# function is a go() function: it takes (s, i, cx) and returns the new
+# i, or -1 for failure. Within it, the code for a peg updates the
+# locals i and vals in place and leaves i < 0 on failure; vals goes
+# back into cx.vals around calls out.
+
+def compile(peg):
+    """Return a peg that acts just like peg but runs as specialized
+    Python code."""
+    return _Compiler().compile([peg])[0]
+
+class _Compiler(object):
+
+    max_depth = 10              # How deeply to nest code before splitting off a function.
+
+    def __init__(self):
+        self.env = {}           # Constants the generated code refers to.
+        self.constants = {}     # id(constant) -> its name in env
+        self.functions = {}     # peg -> name of its generated function
+        self.pending = []       # (peg, function name) still to generate
+        self.defs = []          # Generated function definitions
+        self.stubs = []         # (stub peg, function name) to fill in after exec
+        self.memos = {}         # memo peg -> its stand-in calling generated code
+        self.n_temps = 0
+        self.uses = collections.Counter()
+
+    def compile(self, pegs):
+        for peg in pegs: self.count_uses(peg)
+        roots = [self.function(peg) for peg in pegs]
+        while self.pending:
+            self.define(*self.pending.pop())
+        exec('\n\n'.join(self.defs), self.env)
+        for stub, name in self.stubs:
+            stub.go = self.env[name]
+        return [peg.__class__(peg.face, None, peg.op, peg.args, self.env[name])
+                for peg, name in zip(pegs, roots)]
+
+    def count_uses(self, peg):
+        agenda = [peg]
+        while agenda:
+            p = agenda.pop()
+            self.uses[p] += 1
+            if self.uses[p] == 1:
+                agenda.extend(_compiled_kids(p))
+
+    def function(self, peg):
+        if peg not in self.functions:
+            self.functions[peg] = name = 'r%d_%s' % (len(self.functions),
+                                                     _py_name(peg))
+            self.pending.append((peg, name))
+        return self.functions[peg]
+
+    def define(self, peg, name):
+        code = self.gen(peg, 0, True)
+        self.defs.append('def %s(s, i, cx):\n    vals = cx.vals\n    %s\n    cx.vals = vals\n    return i'
+                         % (name, _indent('\n'.join(code))))
+        self.env['_unwind'], self.env['_pushed'] = _unwind, _pushed
+        self.env['_no_item'], self.env['_slice'] = _no_item, _slice
+
+    def constant(self, value, hint='k'):
+        if id(value) not in self.constants:
+            self.constants[id(value)] = name = '%s%d' % (hint, len(self.constants))
+            self.env[name] = value
+        return self.constants[id(value)]
+
+    def temp(self, hint):
+        self.n_temps += 1
+        return '%s%d' % (hint, self.n_temps)
+
+    def call(self, peg):
+        return ['cx.vals = vals',
+                'i = %s(s, i, cx)' % self.function(peg),
+                'vals = cx.vals']
+
+    def gen(self, p, depth, top=False):
+        "Return lines of code to run p."
+        while p.op == 'label': p = p.args[0]
+        if p is empty: return []
+        op = p.op
+        if op == 'delay':
+            q = _forced_if_ready(p)
+            return self.gen_opaque(p) if q is None else self.call(q)
+        if op in _compound_ops and not top and (self.max_depth < depth
+                                                 or 1 < self.uses[p]):
+            return self.call(p)
+        method = getattr(self, 'gen_' + op, None) if op else None
+        if method is None:
+            return self.gen_opaque(p)
+        return method(p, depth, *p.args)
+
+    def gen_opaque(self, p):
+        return ['cx.vals = vals',
+                'i = %s.go(s, i, cx)' % self.constant(p, 'p'),
+                'vals = cx.vals']
+
+    def gen_fail(self, p, depth):
+        return ['i = -1']
+
+    def gen_position(self, p, depth):
+        return ['vals = i, vals']
+
+    def gen_literal(self, p, depth, string):
+        if _high_bytes(string):
+            return self.gen_match(p, depth, re.escape(string))
+        return ['if s[i:i+%d] == %s:' % (len(string), self.constant(string, 'lit')),
+                '    i += %d' % len(string),
+                '    if cx.far < i: cx.far = i',
+                'else:',
+                '    i = -1']
+
+    def gen_match(self, p, depth, regex):
+        compiled = re.compile(regex)
+        code = ['m = %s(s, i)' % self.constant(compiled.match, 're'),
+                'if m is None:',
+                '    i = -1',
+                'else:',
+                '    i = m.end()',
+                '    if cx.far < i: cx.far = i']
+        for group in range(1, compiled.groups+1):
+            code.append('    vals = m.group(%d), vals' % group)
+        return code
+
+    def gen_fused(self, p, depth, regex, q):
+        return (['m = %s(s, i)' % self.constant(re.compile(_named_groups(regex)).match, 're'),
+                 'if m is None:']
+                + _indented(self.gen(q, depth+1))
+                + ['else:',
+                   '    i = m.end()',
+                   '    if cx.far < i: cx.far = i'])
+
+    def gen_one_of(self, p, depth, item):
+        return ['try:',
+                '    ok = %s == s[i]' % self.constant(item, 'item'),
+                'except IndexError:',
+                '    i = -1',
+                'else:',
+                '    if ok:',
+                '        i += 1',
+                '        if cx.far < i: cx.far = i',
+                '    else:',
+                '        i = -1']
+
+    def gen_one_that(self, p, depth, ok):
+        return ['try:',
+                '    item = s[i]',
+                'except IndexError:',
+                '    i = -1',
+                'else:',
+                '    if %s(item):' % self.constant(ok, 'ok'),
+                '        i += 1',
+                '        if cx.far < i: cx.far = i',
+                '    else:',
+                '        i = -1']
+
+    def gen_capture(self, p, depth, q):
+        i0 = self.temp('i')
+        return (['%s = i' % i0]
+                + self.gen(q, depth+1)
+                + ['if 0 <= i: vals = _slice(s, %s, i), vals' % i0])
+
+    def gen_seclude(self, p, depth, q):
+        base0 = self.temp('base')
+        return (['%s, cx.base = cx.base, vals' % base0]
+                + self.gen(q, depth+1)
+                + ['cx.base = %s' % base0])
+
+    def gen_fed(self, p, depth, q, fn):
+        base0 = self.temp('base')
+        return (['%s, cx.base = cx.base, vals' % base0]
+                + self.gen(q, depth+1)
+                + ['if 0 <= i: vals = %s(*_unwind(vals, cx.base)), cx.base'
+                   % self.constant(fn, 'fn'),
+                   'cx.base = %s' % base0])
+
+    def gen_chain(self, p, depth, q, r):
+        code = self.gen(q, depth+1)
+        for r in _flatten('chain', r):
+            code += ['if 0 <= i:'] + _indented(self.gen(r, depth+1))
+        return code
+
+    def gen_either(self, p, depth, q, r):
+        i0, vals0 = self.temp('i'), self.temp('vals')
+        code = ['%s, %s = i, vals' % (i0, vals0)]
+        # Skip alternatives that can't start with the next item.
+        alts = _flatten('either', p)
+        guards = []
+        for chars, nullable in map(_first, alts):
+            guards.append(None if chars is None or nullable
+                          else self.constant(frozenset(chars), 'first'))
+        if any(guards):
+            item = self.temp('item')
+            code += ['try:',
+                     '    %s = s[i]; hash(%s)' % (item, item),
+                     'except (IndexError, TypeError):',
+                     '    %s = _no_item' % item]
+            if guards[0]: code += ['i = -1']
+        for k, (r, guard) in enumerate(zip(alts, guards)):
+            alt_code = self.gen(r, depth+1)
+            if k == 0 and not guard:
+                code += alt_code
+                continue
+            test = 'i < 0' if k else ''
+            if guard:
+                test += (' and ' if test else '') + '%s in %s' % (item, guard)
+            code += (['if %s:' % test,
+                      '    i, vals = %s, %s' % (i0, vals0)]
+                     + _indented(alt_code))
+        return code
+
+    def gen_invert(self, p, depth, q):
+        i0, vals0, far0 = self.temp('i'), self.temp('vals'), self.temp('far')
+        return (['%s, %s, %s = i, vals, cx.far' % (i0, vals0, far0)]
+                + self.gen(q, depth+1)
+                + ['cx.far = %s' % far0,
+                   'if i < 0: i, vals = %s, %s' % (i0, vals0),
+                   'else: i = -1'])
+
+    def gen_star(self, p, depth, q):
+        i0, vals0 = self.temp('i'), self.temp('vals')
+        # N.B. we stop if q succeeds without advancing, where the
+        # interpreter would recurse forever.
+        return (['while True:',
+                 '    %s, %s = i, vals' % (i0, vals0)]
+                + _indented(self.gen(q, depth+1))
+                + ['    if i < 0:',
+                   '        i, vals = %s, %s' % (i0, vals0),
+                   '        break',
+                   '    if i == %s: break' % i0])
+
+    def gen_alter(self, p, depth, fn):
+        return ['vals = _pushed(cx.base, %s(*_unwind(vals, cx.base)))'
+                % self.constant(fn, 'fn')]
+
+    def gen_feed(self, p, depth, fn):
+        return ['vals = %s(*_unwind(vals, cx.base)), cx.base'
+                % self.constant(fn, 'fn')]
+
+    def gen_push(self, p, depth, c):
+        return ['vals = %s, vals' % self.constant(c, 'c')]
+
+    def gen_memo(self, p, depth, q, table):
+        if p not in self.memos:
+            stub = _Peg(q.face, None, go=fail.go)
+            self.stubs.append((stub, self.function(q)))
+            self.memos[p] = memo(stub, table)
+        return self.gen_opaque(self.memos[p])
+
+_no_item = object()             # Stands for the item past the end, or an unhashable one.
+
+_compound_ops = set(['capture', 'seclude', 'chain', 'either', 'invert', 'star', 'fed'])
+
+def _compiled_kids(p):
+    "The pegs that compiling p may generate code for along with it."
+    if p.op == 'delay':                      return filter(None, [_forced_if_ready(p)])
+    if p.op in _compound_ops or p.op in ('label', 'memo', 'fused'):
+        return [q for q in p.args if isinstance(q, _Peg)]
+    return []
+
+def _forced_if_ready(p):
+    """Force the delay() p if we can, or else return None. (A delay may
+    name something not defined yet; then we'll leave it till parse time.)"""
+    try:
+        return _forced(p)
+    except Exception:
+        return None
+
+def _py_name(peg):
+    "Make something like an identifier out of peg's face, for readability."
+    return re.sub(r'\W+', '_', peg.face if isinstance(peg.face, str) else peg.op or '')[:20]
+
+def _indented(lines):
+    return ['    ' + line for line in lines]
+
+def _indent(s):
+    return s.replace('\n', '\n    ')
+
+
 # Build pegs from a string representation of a grammar.
 
 class Grammar(object):
@@ -297,23 +1422,69 @@ class Grammar(object):
         self.skeletons = _parse_grammar(string)
     def __call__(self, **subs):
         return self.bind(subs)
-    def bind(self, subs):       # subs = substitutions
+    def bind(self, subs, packrat=False, spans=None, profile=None,
+             backtracking=None):
+        """Make the rules into pegs, resolving :foo actions from subs
+        (substitutions). With packrat true, memoize each rule's results
+        during a parse; packrat may also be a memo-table maker like
+        lru(10000). With spans a Spans, note in it where each action's
+        result came from. With profile a Profile, count and time each
+        rule's runs in it. With backtracking a Backtracking, note in it
+        where the parse does work only to undo it."""
+        return _rules_struct(*self._bind(subs, packrat, spans, profile,
+                                         backtracking))
+    def iterparse(self, rule, subs, packrat=False, spans=None, profile=None,
+                  backtracking=None):
+        """Like bind(), but return a function that iterparse()s its
+        argument by the named rule (or by the start rule if None)."""
+        start, rules = self._bind(subs, packrat, spans, profile, backtracking)
+        return (start if rule is None else rules[rule]).iterparse
+    def compile(self, subs, packrat=False, spans=None):
+        """Like bind(), but with the rules compiled together to Python
+        code, as by compile()."""
+        start, rules = self._bind(subs, packrat, spans)
+        names = sorted(rules)
+        pegs = [rules[name] for name in names]
+        if start is not None: pegs.append(start)
+        compiled = _Compiler().compile(pegs)
+        if start is not None: start = compiled.pop()
+        return _rules_struct(start, dict(zip(names, compiled)))
+    def _bind(self, subs, packrat, spans=None, profile=None, backtracking=None):
+        "Return the anonymous start rule, if any, and a dict of the rules."
+        if packrat is True: packrat = dict
         if isinstance(subs, types.ModuleType):
             subs = subs.__dict__
-        result = None
+        start = None
         rules = {name: delay(lambda: rules[name], name)
                  for (name,_,_) in self.skeletons if name is not None}
-        for rule, fnord_rule_type, (_,f) in self.skeletons:
-            peg = f(self, rules, fnord_rule_type == '', subs)
+        for rule, fnord_rule_type, (_,tree) in self.skeletons:
+            if spans is not None and _has_action(tree):  # An = rule's body
+                peg = _spanned_body(_build(tree, self, rules, fnord_rule_type == '',
+                                           subs, spans, True))
+            else:
+                peg = _build(tree, self, rules, fnord_rule_type == '', subs, spans)
             if rule is None:
-                result = peg
+                start = peg
             else:
                 rules[rule] = label(peg, rule)
+        fuser = _Fuser(rules)
+        if start is not None: start = fuser.fused(start)
+        for rule in rules:
+            rules[rule] = label(fuser.fused(rules[rule].args[0]), rule)
+        if backtracking is not None:
+            if start is not None: start = _watched_rule(start, '(start)', backtracking)
+            for rule in rules:
+                rules[rule] = label(_watched_rule(rules[rule].args[0], rule, backtracking), rule)
+        if packrat:
+            for rule in rules:
+                rules[rule] = label(memo(rules[rule].args[0], packrat), rule)
+        if profile is not None:
+            if start is not None: start = _profiled(start, '(start)', profile)
+            for rule in rules:
+                rules[rule] = label(_profiled(rules[rule].args[0], rule, profile), rule)
+        _link(filter(None, [start]) + rules.values())
         # XXX warn about unresolved :foo interpolations at this point?
-        if result is None:
-            result = _Struct()
-        result.__dict__.update(rules)
-        return result
+        return start, rules
     def literal(self, string):
         return literal(string)
     def match(self, regex):
@@ -323,9 +1494,319 @@ class Grammar(object):
 
 word_boundary = match(r'\b')
 
+class Spans(object):
+    """Where in the input each result of a :foo action came from, for
+    a grammar bound with spans=Spans(). A result's span runs from the
+    start of its rule, or of its [...] group, to the action. Look one
+    up by spans[result], for a (start, end) pair."""
+    # XXX an id() can be reused once its value's gone, and values like
+    #  small ints and short strings get shared, so a span is only as
+    #  good as its value is unique and alive. AST nodes should be fine.
+    # (Kept in arrays, not as a tuple per value.)
+    def __init__(self):
+        self.clear()
+    def clear(self):
+        "Forget the spans noted so far."
+        self.ids = array.array('l')     # id() of each result
+        self.starts = array.array('l')
+        self.ends = array.array('l')
+        self.index, self.indexed = {}, 0
+    def note(self, value, start, end):
+        self.ids.append(id(value))
+        self.starts.append(start)
+        self.ends.append(end)
+    def __len__(self):
+        return len(self.ids)
+    def __getitem__(self, value):
+        "Return (start, end) of value's span, or raise KeyError."
+        k = self.find(value)
+        if k is None: raise KeyError(value)
+        return self.starts[k], self.ends[k]
+    def get(self, value, default=None):
+        k = self.find(value)
+        return default if k is None else (self.starts[k], self.ends[k])
+    def find(self, value):
+        "Return the index in the arrays of value's latest span, or None."
+        ids, index = self.ids, self.index
+        for k in xrange(self.indexed, len(ids)):
+            index[ids[k]] = k
+        self.indexed = len(ids)
+        return index.get(id(value))
+
+class Profile(object):
+    """Counts and times of each rule's runs, for a grammar bound with
+    profile=Profile(). rules maps each rule's name to its stats. (Under
+    a pegvm.Feeder, a rule's time takes in any time the parse spent
+    suspended inside it, waiting for input.)"""
+    def __init__(self, timer=time.time):
+        self.timer = timer
+        self.rules = {}
+        self.frames = [[[0.0, {}], 0.0]]
+    def clear(self):
+        "Forget the counts and times so far."
+        for stats in self.rules.values(): stats.__init__()
+        del self.frames[1:]
+        self.frames[0][:] = [[0.0, {}], 0.0]
+    def report(self, key='exclusive'):
+        """Return a table of each rule's stats, the biggest by key (an
+        attribute of _RuleStats) first. Times are in ms; a rule's
+        inclusive time counts its calls to other rules, and exclusive
+        doesn't."""
+        lines = ['%-20s %8s %8s %8s %10s %10s %10s'
+                 % ('rule', 'calls', 'succeed', 'fail', 'consumed', 'incl ms', 'excl ms')]
+        for name, st in sorted(self.rules.items(),
+                               key=lambda (name, st): (-getattr(st, key), name)):
+            if st.calls:
+                lines.append('%-20s %8d %8d %8d %10d %10.3f %10.3f'
+                             % (name, st.calls, st.successes, st.failures,
+                                st.consumed, st.inclusive*1000, st.exclusive*1000))
+        return '\n'.join(lines)
+    def folded(self):
+        """Return the exclusive times by stack of rule calls, one line
+        per stack like 'a;b;c 123' (in microseconds), the input format
+        of flamegraph.pl."""
+        lines = []
+        def walk(path, (seconds, kids)):
+            microseconds = int(round(seconds * 1e6))
+            if path and microseconds: lines.append('%s %d' % (';'.join(path), microseconds))
+            for name in sorted(kids): walk(path + (name,), kids[name])
+        walk((), self.frames[0][0])
+        return ''.join(line + '\n' for line in lines)
+
+class _RuleStats(object):
+    __slots__ = ('calls', 'successes', 'consumed', 'inclusive', 'exclusive', 'active')
+    def __init__(self):
+        self.calls = self.successes = self.consumed = self.active = 0
+        self.inclusive = self.exclusive = 0.0
+    @property
+    def failures(self):
+        return self.calls - self.successes
+
+# The profile's frames are a stack of [node, seconds in calls from
+# here to other rules, start position, start time] (the bottom frame
+# has just the first two). A node, [exclusive seconds, {rule name:
+# node}], is for one stack of rule calls; they make a tree from the
+# root in the bottom frame.
+
+def _profiled(p, name, profile):
+    "Return a peg like p, noting its runs in profile under name."
+    stats = profile.rules.setdefault(name, _RuleStats())
+    timer, frames = profile.timer, profile.frames
+    # enter() and leave() bracket each run, here and on pegvm's machine;
+    # offset is how much input came before the start of the subject.
+    def enter(cx, i, offset=0):
+        caller = frames[-1]
+        kids = caller[0][1]
+        node = kids.get(name)
+        if node is None: node = kids[name] = [0.0, {}]
+        stats.calls += 1
+        stats.active += 1
+        frames.append([node, 0.0, offset + i, timer()])
+    def leave(cx, j, offset=0):
+        t1 = timer()
+        node, inner, i, t0 = frames.pop()
+        elapsed = t1 - t0
+        stats.active -= 1
+        if not stats.active: stats.inclusive += elapsed # (Not again when recursive.)
+        own = elapsed - inner
+        stats.exclusive += own
+        node[0] += own
+        frames[-1][1] += elapsed
+        if 0 <= j:
+            stats.successes += 1
+            stats.consumed += offset + j - i
+    def go(s, i, cx):
+        enter(cx, i)
+        j = -1
+        try:
+            j = p.go(s, i, cx)
+        finally:
+            leave(cx, j)
+        return j
+    # (The hooks go in args, where a grammar's rules can't clobber them.)
+    return _Peg(('profiled(%r)', p), None, 'profiled', (p, name, (enter, leave)), go)
+
+class Backtracking(object):
+    """Where a grammar's parses do work only to throw it away, for a
+    grammar bound with backtracking=Backtracking(). For each rule, and
+    each alternative of a | in a rule, it counts the tries, the retries
+    (tries at a position already tried in the same parse), the failures,
+    and the input that failed tries got through before giving up. (An
+    alternative that Grammar fuses into one regex with its neighbors
+    gets no counts of its own: it backtracks inside the regex engine.)"""
+    # (Rules with many retries want memo(); a big total of wasted input
+    # means lookahead that's too late, and maybe time superlinear in the
+    # input.)
+    def __init__(self):
+        self.places = {}        # 'rule' or 'rule|n' -> _PlaceStats
+    def clear(self):
+        "Forget the counts so far."
+        for stats in self.places.values(): stats.__init__(stats.what)
+    def report(self, key='wasted'):
+        """Return a table of each place's stats, the biggest by key (an
+        attribute of _PlaceStats) first. A place is a rule, or 'rule|n'
+        for the nth alternative of a | in the rule, shown at the end."""
+        lines = ['%-20s %8s %8s %8s %10s  %s'
+                 % ('place', 'tries', 'retries', 'fail', 'wasted', 'alternative')]
+        for place, st in sorted(self.places.items(),
+                                key=lambda (place, st): (-getattr(st, key), place)):
+            if st.tries:
+                lines.append(('%-20s %8d %8d %8d %10d  %s'
+                              % (place, st.tries, st.retries, st.failures,
+                                 st.wasted, st.what)).rstrip())
+        return '\n'.join(lines)
+
+class _PlaceStats(object):
+    __slots__ = ('what', 'tries', 'retries', 'failures', 'wasted')
+    def __init__(self, what=''):
+        self.what = what
+        self.tries = self.retries = self.failures = self.wasted = 0
+
+def _watched_rule(p, rule, backtracking):
+    "Return a peg like the rule p, with it and its alternatives watched."
+    count = itertools.count(1)
+    def watching(q):
+        if q.op == 'either':
+            return _rebuilt_binary(q, either,
+                                   [_watched(watching(r), '%s|%d' % (rule, next(count)),
+                                             backtracking, _short_repr(r))
+                                    for r in _flatten('either', q)])
+        if q.op not in _optimizer_rebuilders: return q
+        kids = [watching(r) if isinstance(r, _Peg) else r for r in q.args]
+        if all(r is r0 for r, r0 in zip(kids, q.args)): return q
+        if q.op == 'label': return label(kids[0], q.face)
+        return _optimizer_rebuilders[q.op](*kids)
+    return _watched(watching(p), rule, backtracking)
+
+def _short_repr(p, width=40):
+    s = repr(p)
+    return s if len(s) <= width else s[:width-3] + '...'
+
+def _watched(p, place, backtracking, what=''):
+    "Return a peg like p, noting its tries in backtracking under place."
+    stats = backtracking.places.setdefault(place, _PlaceStats(what))
+    runs = []               # (far, i) on entering each run not yet left
+    # As for _profiled(), enter() and leave() bracket each run.
+    def enter(cx, i, offset=0):
+        stats.tries += 1
+        # (A dict, not a set, so pegvm can forget the old positions.)
+        tried = _memo_table(cx, q, dict)
+        if i in tried: stats.retries += 1
+        else: tried[i] = True
+        # How far does p get? cx.far is the farthest in the whole parse
+        # so far; it has to come out the same.
+        runs.append((offset + cx.far, offset + i))
+        cx.far = i
+    def leave(cx, j, offset=0):
+        far, i = runs.pop()
+        reach = offset + cx.far
+        if reach < far: cx.far = far - offset
+        if j < 0:
+            stats.failures += 1
+            stats.wasted += reach - i
+    def go(s, i, cx):
+        enter(cx, i)
+        j = -1
+        try:
+            j = p.go(s, i, cx)
+        finally:
+            leave(cx, j)
+        return j
+    q = _Peg(('watched(%r)', p), None, 'watched', (p, place, (enter, leave)), go)
+    return q
+
+# With spans, each [...] group with actions of its own (including a
+# : rule's body), and each = rule's body with actions outside any
+# [...], starts by pushing a _SpanStart of its position. An action
+# takes the values other than the starts, and keeps the starts, for
+# the next action to see too; the last start is its own. (An = rule's
+# body shares its values with its caller's, starts and all.) The body
+# ends by dropping its start.
+
+class _SpanStart(object):
+    __slots__ = ('position',)
+    def __init__(self, position):
+        self.position = position
+
+def _has_action(tree):
+    "Does this tree of a [...] group have a :foo of its own?"
+    if tree[0] == 'unquote': return True
+    if tree[0] == 'seclude': return False
+    return any(_has_action(t) for t in tree[1:] if isinstance(t, tuple))
+
+def _spanned_group(p):
+    return seclude(_spanned_body(p))
+
+def _spanned_body(p):
+    return chain(_span_start, chain(p, _unspanned))
+
+_span_start = chain(position,
+                    alter(lambda *values: values[:-1] + (_SpanStart(values[-1]),)))
+
+def _unspan(*values):
+    for k in range(len(values)-1, -1, -1):
+        if type(values[k]) is _SpanStart:
+            return values[:k] + values[k+1:]
+    return values
+
+_unspanned = alter(_unspan)
+
+def _span_starts(values):
+    "Split values into the _SpanStarts and the rest."
+    starts = tuple(v for v in values if type(v) is _SpanStart)
+    if not starts: return starts, values
+    return starts, tuple(v for v in values if type(v) is not _SpanStart)
+
+def _spanned_action(peg, spans):
+    if peg.op == 'feed':
+        fn = peg.args[0]
+        def spanning(*values):
+            starts, args = _span_starts(values[:-1])
+            result = fn(*args)
+            spans.note(result, starts[-1].position, values[-1])
+            return starts + (result,)
+        return label(chain(position, alter(spanning)), peg.face)
+    if peg.op == 'alter':
+        fn = peg.args[0]
+        def altering(*values):
+            starts, args = _span_starts(values)
+            return starts + fn(*args)
+        return label(alter(altering), peg.face)
+    return peg
+
+def _link(pegs):
+    """Finish off the pegs and all they reach, for parsing without the
+    indirections of building them: force each delay() and settle each
+    either(), then give each label() and delay() the go() of the peg
+    it stands for, so calling one is calling that."""
+    reached = set(q for p in pegs for q in walk(p))
+    for p in reached:
+        if p.op == 'either': _settle(p)
+    for p in reached:
+        q, seen = p, set()
+        while q is not None and q.op in ('label', 'delay') and q not in seen:
+            seen.add(q)
+            q = q.args[0] if q.op == 'label' else _forced_if_ready(q)
+        if q is not None and q not in seen:
+            p.run, p.go = q.run, q.go
+
 class _Struct(object): pass
 
+def _rules_struct(start, rules):
+    "Return start, or a new _Struct if None, with the rules as attributes."
+    result = _Struct() if start is None else start
+    result.__dict__.update(rules)
+    return result
+
 def _parse_grammar(string):
+    path = _cache_path(string)
+    skeletons = path and _load_skeletons(path)
+    if skeletons is None:
+        skeletons = _parse_new_grammar(string)
+        if path: _save_skeletons(path, skeletons)
+    return skeletons
+
+def _parse_new_grammar(string):
     try:
         skeletons = _grammar_grammar(string)
     except Unparsable, e:
@@ -339,15 +1820,65 @@ def _parse_grammar(string):
     dups = sorted(lhs for lhs,n in counts.items() if 1 < n)
     if dups:
         raise GrammarError("Multiply-defined rules: %s" % ', '.join(dups))
+    if None in lhses:
+        # The start rule's peg holds the other rules as attributes, and
+        # these names are its own.
+        taken = sorted(set(lhses) & set(_Peg.__slots__))
+        if taken:
+            raise GrammarError("Rule names taken by the start rule: %s"
+                               % ', '.join(taken))
     return skeletons
 
 class GrammarError(Exception): pass
 
+# Grammar() keeps the skeletons of the grammars it parses in files in
+# this directory, so that a grammar seen before costs about a file read.
+# Set it to None (or $PARSON_CACHE_DIR to '') to not cache.
+# To cache parsed grammars on disk, set PARSON_CACHE_DIR (or this) to
+# a directory. An entry's key covers this module's own code, so editing
+# the grammar grammar or the skeleton builder can't serve stale ones.
+grammar_cache_dir = os.environ.get('PARSON_CACHE_DIR') or None
+
+_code_digest = None             # A hash of this module's source, once needed.
+
+def _cache_path(string):
+    global _code_digest
+    if grammar_cache_dir is None: return None
+    import hashlib              # (Here, to keep 'import parson' quick.)
+    if _code_digest is None:
+        source = os.path.splitext(__file__)[0] + '.py'
+        try:
+            with open(source if os.path.exists(source) else __file__, 'rb') as f:
+                _code_digest = hashlib.sha1(f.read()).hexdigest()
+        except IOError:
+            return None
+    key = (_code_digest, sys.version_info[:2], string)
+    return os.path.join(grammar_cache_dir, hashlib.sha1(repr(key)).hexdigest())
+
+def _load_skeletons(path):
+    try:
+        with open(path, 'rb') as f:
+            return marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+
+def _save_skeletons(path, skeletons):
+    # Write then rename, so a reader never sees a partial file.
+    temp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        if not os.path.isdir(grammar_cache_dir):
+            os.makedirs(grammar_cache_dir)
+        with open(temp, 'wb') as f:
+            marshal.dump(skeletons, f)
+        os.rename(temp, path)
+    except (IOError, OSError):
+        pass                    # The cache is just an optimization.
+
 _builtins = __builtins__ if isinstance(__builtins__, dict) else __builtins__.__dict__
-_default_subs = dict((k, feed(v))
-                     for k, v in _builtins.items() if callable(v))
-_default_subs.update({'hug': feed(hug), 'join': feed(join), 'None': push(None),
-                      'anyone': anyone, 'end': end, 'position': position})
+# Besides these, any callable builtin is a default sub, as a feed().
+# We make those as needed, to not slow down 'import parson'.
+_default_subs = {'hug': feed(hug), 'join': feed(join), 'None': push(None),
+                 'anyone': anyone, 'end': end, 'position': position}
 
 def _lookup(subs, name):
     # We don't use subs.get(name) because subs might be a dictlike object
@@ -356,39 +1887,70 @@ def _lookup(subs, name):
     try:
         return subs[name]
     except KeyError:
+        if name not in _default_subs:
+            if not callable(_builtins[name]): raise
+            _default_subs[name] = feed(_builtins[name])
         return _default_subs[name]
 
-def _make_grammar_grammar():
+# A rule's skeleton is its name (None for the anonymous start rule),
+# '' or '~' for whether it gets FNORDs, and a pair of the set of rules
+# it refers to and its body as a tree of tuples, like
+# ('chain', ('literal', 'x'), ('ref', 'y')). Skeletons are plain data so
+# we can keep them in the cache.
+
+def _build(tree, builder, rules, allow_fnord, subs, spans=None, grouped=False):
+    "Make a peg from a skeleton's tree."
+    tag = tree[0]
+    if tag == 'ref':
+        name = tree[1]
+        return _rule_ref(rules, name)
+    if tag == 'unquote':
+        peg = Peg(_lookup(subs, tree[1]))
+        return _spanned_action(peg, spans) if grouped else peg
+    if tag == 'seclude' and spans is not None and _has_action(tree[1]):
+        return _spanned_group(_build(tree[1], builder, rules, allow_fnord, subs,
+                                     spans, True))
+    if tag == 'push':    return push(tree[1])
+    if tag == 'literal': return builder.literal(tree[1])
+    if tag == 'keyword': return builder.keyword(tree[1])
+    if tag == 'match':   return builder.match(tree[1])
+    if tag == 'empty':   return empty
+    if tag == 'fnordly':
+        result = _build(tree[1], builder, rules, allow_fnord, subs, spans, grouped)
+        if allow_fnord and 'FNORD' in rules:
+            # N.B. we don't add FNORD to refs; it won't matter.
+            result = chain(result, _rule_ref(rules, 'FNORD'))
+        return result
+    return _tree_ops[tag](*[_build(t, builder, rules, allow_fnord, subs,
+                                   spans, grouped)
+                            for t in tree[1:]])
+
+def _rule_ref(rules, name):
+    "Return a delay() for rules[name], one that _Fuser may peek through."
+    q = delay(lambda: rules[name], name)
+    q.rule = name
+    return q
 
-    def mk_rule_ref(name):
-        return (set([name]),
-                lambda builder, rules, af, subs: delay(lambda: rules[name], name))
+_tree_ops = dict(either=either, chain=chain, invert=invert, star=star, plus=plus,
+                 maybe=maybe, seclude=seclude, capture=capture)
+
+def _make_grammar_grammar():
 
-    def constant(peg): return (set(), lambda builder, rules, af, subs: peg)
+    def mk_rule_ref(name): return (set([name]), ('ref', name))
 
-    def lift(peg_op):
-        return lambda *lifted: (
-            set().union(*[refs for refs,_ in lifted]),
-            lambda builder, rules, af, subs: peg_op(*[f(builder, rules, af, subs)
-                                                      for _,f in lifted])
-        )
+    def lift(tag):
+        return lambda *lifted: (set().union(*[refs for refs,_ in lifted]),
+                                (tag,) + tuple(tree for _,tree in lifted))
 
-    def mk_fnordly((refs, mk_peg)):
-        def mk_result(builder, rules, allow_fnord, subs):
-            result = mk_peg(builder, rules, allow_fnord, subs)
-            if allow_fnord and 'FNORD' in rules:
-                # N.B. we don't add FNORD to refs; it won't matter.
-                result = chain(result, delay(lambda: rules['FNORD'], 'FNORD'))
-            return result
-        return (refs, mk_result)
+    def mk_fnordly((refs, tree)): return (refs, ('fnordly', tree))
 
-    unquote     = lambda name: (set(), lambda _, rules, af, subs: Peg(_lookup(subs, name)))
+    unquote     = lambda name: (set(), ('unquote', name))
 
-    mk_push_lit = lambda string: constant(push(string))
+    mk_push_lit = lambda string: (set(), ('push', string))
 
-    def mk_literal(s): return (set(), lambda builder, _, __, ___: builder.literal(s))
-    def mk_keyword(s): return (set(), lambda builder, _, __, ___: builder.keyword(s))
-    def mk_match(s):   return (set(), lambda builder, _, __, ___: builder.match(s))
+    def mk_literal(s): return (set(), ('literal', s))
+    def mk_keyword(s): return (set(), ('keyword', s))
+    def mk_match(s):   return (set(), ('match', s))
 
     whitespace     = match(r'(?:\s|#[^\n]*\n?)+')
     _              = whitespace.maybe()
@@ -405,24 +1967,24 @@ def _make_grammar_grammar():
     fnordly        = (literal('~') + _) | mk_fnordly
 
     pe             = seclude(delay(lambda: 
-                     term + ('|' +_+ pe + lift(either)).maybe()
-                   | lift(lambda: empty)))
+                     term + ('|' +_+ pe + lift('either')).maybe()
+                   | lift('empty')))
 
     term           = seclude(delay(lambda:
-                     factor + (term + lift(chain)).maybe()))
+                     factor + (term + lift('chain')).maybe()))
 
     factor         = seclude(delay(lambda:
-                     '!' +_+ factor                     + lift(invert)
-                   | primary + ( '**' +_+ primary + lift(star)
-                               | '++' +_+ primary + lift(plus)
-                               | '*' +_+ lift(star)
-                               | '+' +_+ lift(plus)
-                               | '?' +_+ lift(maybe)
+                     '!' +_+ factor                     + lift('invert')
+                   | primary + ( '**' +_+ primary + lift('star')
+                               | '++' +_+ primary + lift('plus')
+                               | '*' +_+ lift('star')
+                               | '+' +_+ lift('plus')
+                               | '?' +_+ lift('maybe')
                                ).maybe()))
 
     primary        = ('(' +_+ pe + ')' +_
-                   | '[' +_+ pe + ']' +_                >> lift(seclude)
-                   | '{' +_+ pe + '}' +_                >> lift(capture)
+                   | '[' +_+ pe + ']' +_                >> lift('seclude')
+                   | '{' +_+ pe + '}' +_                >> lift('capture')
                    | seclude(qstring + mk_literal + fnordly)
                    | seclude(dqstring + mk_keyword + fnordly)
                    | seclude('/' + regex_char.star() + '/' +_+ join + mk_match + fnordly)
@@ -435,12 +1997,12 @@ def _make_grammar_grammar():
                      + ('=' +_+ pe
                        | ':' + whitespace # Whitespace is *required* after this ':',
                                           # and *forbidden* after the ':' in 'primary'.
-                         + (pe >> lift(seclude)))
+                         + (pe >> lift('seclude')))
                      + '.' +_ + hug)
 
     anon           = (push(None)
                       + push('')
-                      + seclude(push('') + mk_literal + fnordly + pe + lift(chain))
+                      + seclude(push('') + mk_literal + fnordly + pe + lift('chain'))
                       + hug
                       + ('.' +_+ rule.star()).maybe())
 
@@ -449,7 +2011,13 @@ def _make_grammar_grammar():
 
     return grammar
 
-_grammar_grammar = _make_grammar_grammar()
+def _grammar_grammar(string):
+    "Parse a grammar into skeletons."
+    # We make the real _grammar_grammar only now, on first use, since
+    # plenty of programs import parson and never need it.
+    global _grammar_grammar
+    _grammar_grammar = _make_grammar_grammar()
+    return _grammar_grammar(string)
 
 
 # To help testing. (XXX move this out of the main library)
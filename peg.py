@@ -8,11 +8,15 @@ to do: produce code instead of closures
 to do: bounce less often
 """
 
+import re
+
 # peg constructors
 
 Fail = 'fail', None
 def Alter(fn):     return 'alter', fn
 def Item(ok):      return 'item', ok
+def Literal(string): return 'literal', string
+def Regex(regex):  return 'regex', regex
 def Ref(name):     return 'ref', name
 def Chain(q, r):   return 'chain', (q, r)
 def Cond(q, n, y): return 'cond', (q, n, y)
@@ -26,6 +30,8 @@ def translate(pr, peg, f, s):
     if   tag == 'fail':  return KDrop(f) 
     elif tag == 'alter': return KAlter(arg, s)
     elif tag == 'item':  return KItem(arg, f, s)
+    elif tag == 'literal': return KLiteral(arg, f, s)
+    elif tag == 'regex': return KRegex(re.compile(arg), f, s)
     elif tag == 'ref':   return KCall(pr, arg, f, s)
     elif tag == 'chain': return translate(pr, arg[0], f,
                                           translate(pr, arg[1], f, s))
@@ -46,48 +52,62 @@ def run(q, defns, vs, cs):
     for name, defn in defns.items():
         pr[name] = translate(pr, defn, KFail, KSucceed)
     return trampoline(translate(pr, q, KFinalFail, KFinalSucceed),
-                      ((vs,cs,()), ()))
+                      cs, ((vs,0,()), ()))
 
 
 # The parsing machine.
-# continuation: trail -> result
-# trail: () | ((vs,cs,ks), trail)
+# continuation: (cs, trail) -> result
+# cs: input sequence -- a string, list, buffer... -- never copied
+# trail: () | ((vs,i,ks), trail)
 # vs: tuple of values from semantic actions
-# cs: input character sequence (the current tail thereof)
+# i: our position in cs
 # ks: () | ((fail_cont,success_cont), ks)
 
-def trampoline(cont, trail):
+def trampoline(cont, cs, trail):
     while cont is not None:
-        cont, trail = cont(trail)
+        cont, trail = cont(cs, trail)
     return trail
 
-def KFinalFail(trail):
+def KFinalFail(cs, trail):
     assert trail is ()
     return None, 'fail'
-def KFinalSucceed(((vs,cs,ks), trail)):
+def KFinalSucceed(cs, ((vs,i,ks), trail)):
     assert trail is ()
     assert ks is ()
-    return None, (vs, cs)
+    return None, (vs, cs[i:])
 
-def KDrop(cont): return lambda (_, trail): (cont, trail)
-def KNip(cont): return lambda (entry, (_, trail)): (cont, (entry, trail))
-def KDup(cont): return lambda (entry, trail): (cont, (entry, (entry, trail)))
+def KDrop(cont): return lambda cs, (_, trail): (cont, trail)
+def KNip(cont): return lambda cs, (entry, (_, trail)): (cont, (entry, trail))
+def KDup(cont): return lambda cs, (entry, trail): (cont, (entry, (entry, trail)))
 
 def KAlter(fn, s):
-    return lambda ((vs,cs,ks), trail): (s, ((fn(*vs),cs,ks), trail))
+    return lambda cs, ((vs,i,ks), trail): (s, ((fn(*vs),i,ks), trail))
 
 def KItem(ok, f, s):
-    return lambda ((vs,cs,ks), trail): (
-        (s, ((vs+(cs[0],), cs[1:], ks), trail)) if cs and ok(cs[0])
+    return lambda cs, ((vs,i,ks), trail): (
+        (s, ((vs+(cs[i],), i+1, ks), trail)) if i < len(cs) and ok(cs[i])
+        else (f, trail))
+
+def KLiteral(string, f, s):
+    n = len(string)
+    return lambda cs, ((vs,i,ks), trail): (
+        (s, ((vs, i+n, ks), trail)) if cs[i:i+n] == string
         else (f, trail))
 
+def KRegex(regex, f, s):
+    def k(cs, ((vs,i,ks), trail)):
+        m = regex.match(cs, i)
+        if m is None: return f, trail
+        return s, ((vs+m.groups(), m.end(), ks), trail)
+    return k
+
 def KCall(pr, name, f, s):
-    return lambda ((vs,cs,ks), trail): (
-        pr[name], ((vs,cs,((f,s),ks)), trail))
-def KFail(((vs,cs,((fk,_),ks)), trail)):
+    return lambda cs, ((vs,i,ks), trail): (
+        pr[name], ((vs,i,((f,s),ks)), trail))
+def KFail(cs, ((vs,i,((fk,_),ks)), trail)):
     return fk, trail
-def KSucceed(((vs,cs,((_,sk),ks)), trail)):
-    return sk, ((vs,cs,ks), trail)
+def KSucceed(cs, ((vs,i,((_,sk),ks)), trail)):
+    return sk, ((vs,i,ks), trail)
 
 
 # Smoke test
@@ -112,3 +132,9 @@ def test(string):
 #. ((), 'xy')
 ## test('01101a')
 #. (('0', '1', '1', '0', '1'), 'a')
+## test(buffer('01101a'))
+#. (('0', '1', '1', '0', '1'), 'a')
+## test(list('01101a'))
+#. (('0', '1', '1', '0', '1'), ['a'])
+## run(Chain(Literal('01'), Regex('(1*)(0)')), {}, (), '01110x')
+#. (('11', '0'), 'x')
@@ -4,7 +4,6 @@ Avoids Python stack overflow.
 Also a step towards compiling instead of interpreting.
 
 to do: test this: optimize q==y with Nip
-to do: produce code instead of closures
 to do: bounce less often
 
 to do: compare:
@@ -21,112 +20,885 @@ to do: compare:
   combinator parsers based on Maybe.
 """
 
-dbg = 1
+import re, sre_compile, sre_constants, sre_parse
+
+import parson
 
 # peg constructors
 
 Fail = 'fail', ()
 def Alter(fn):     return 'alter', fn
 def Item(ok):      return 'item', ok
+def Literal(string): return 'literal', string
+def Regex(regex):  return 'regex', regex
 def Ref(name):     return 'ref', name
 def Chain(q, r):   return 'chain', (q, r)
 def Cond(q, n, y): return 'cond', (q, n, y)
 
 
-# (install, program, peg, fail_cont, success_cont) -> cont
-# where program: dict(string -> cont)
-#       code: [('operator', (operands,))]
-#       cont: int -- index into code
-def translate(install, pr, peg, f, s):
+# (program, procedures, peg, fail_cont, success_cont) -> cont
+# where procedures: dict(string -> cont)
+#       cont: int -- index into program.code
+def translate(pr, procs, peg, f, s):
     tag, arg = peg
-    if   tag == 'fail':  return install(KDrop, f) 
-    elif tag == 'alter': return install(KAlter, arg, s)
-    elif tag == 'item':  return install(KItem, arg, f, s)
-    elif tag == 'ref':   return install(KCall, pr, arg, f, s) # TODO: how about a jump op for when f is KFail, s is KSucceed?
-    elif tag == 'chain': return translate(install, pr, arg[0], f,
-                                          translate(install, pr, arg[1], f, s))
+    if   tag == 'fail':  return pr.install(DROP, f)
+    elif tag == 'alter': return pr.install(ALTER, arg, s)
+    elif tag == 'item':  return pr.install(ITEM, arg, f, s)
+    elif tag == 'literal': return pr.install(LITERAL, arg, f, s)
+    elif tag == 'regex': return pr.install(MATCH, re.compile(arg), f, s)
+    elif tag == 'ref':   return pr.install(CALL, procs[arg], f, s) # TODO: how about a jump op for when f is FAIL, s is SUCCEED?
+    elif tag == 'chain': return translate(pr, procs, arg[0], f,
+                                          translate(pr, procs, arg[1], f, s))
     elif tag == 'cond':
         q, n, y = arg
         if y == q:
-            yy = install(KNip, s)
+            yy = pr.install(CUT, s)
         elif y[0] == 'chain' and y[1][0] == q:
-            yy = install(KNip, translate(install, pr, y[1][1], f, s))
+            yy = pr.install(CUT, translate(pr, procs, y[1][1], f, s))
         else:
-            yy = install(KDrop, translate(install, pr, y, f, s))
-        return install(KDup, translate(install, pr, q, translate(install, pr, n, f, s), yy))
+            yy = pr.install(DROP, translate(pr, procs, y, f, s))
+        return pr.install(DUP, translate(pr, procs, q, translate(pr, procs, n, f, s), yy))
     else:
         assert False
 
-def run(q, defns, vs, cs):
-    code = []
-    def install(*insn):
-        try: return code.index(insn)
-        except ValueError:
-            try: return len(code)
-            finally: code.append(insn)
-    pr = {}
-    entry = translate(install, pr, q, install(KFinalFail), install(KFinalSucceed))
+def assemble(q, defns):
+    "Return a program for q given defns, its entry, and the procedures' entries."
+    pr = Program()
+    procs = {name: pr.reserve(DUP) for name in defns}
+    entry = translate(pr, procs, q, pr.install(FINAL_FAIL), pr.install(FINAL_SUCCEED))
     for name, defn in defns.items():
-        pr[name] = translate(install, pr, defn, install(KFail), install(KSucceed))
-    if dbg:
-        for name in sorted(pr.keys()):
-            print name, '=>', pr[name]
-        for i, insn in enumerate(code):
-            print i, show(insn)
-    return trampoline(entry, code,
-                      ((vs,cs,()), ()))
-
-def show(insn):
-    return '%s(%s)' % (insn[0].__name__,
-                       ', '.join(x.__name__ if callable(x) else repr(x)
-                                 for x in insn[1:]))
-
-# The parsing machine.
-# continuation: trail -> result
-# trail: () | ((vs,cs,ks), trail)
-# vs: tuple of values from semantic actions
-# cs: input character sequence (the current tail thereof)
-# ks: () | ((fail_cont,success_cont), ks)
-
-def trampoline(pc, code, trail):
-    while pc is not None:
-        insn = code[pc]
-        if dbg: print 'pc', pc, 'insn', show(insn)
-        pc, trail = insn[0](*insn[1:])(trail)
-        assert pc is None or isinstance(pc, int), pc
-    return trail
-
-def KFinalFail():
-    def k(trail):
-        assert trail is ()
-        return None, 'fail'
-    return k
-def KFinalSucceed():
-    def k(((vs,cs,ks), trail)):
-        assert trail is ()
-        assert ks is ()
-        return None, (vs, cs)
-    return k
-
-def KDrop(cont): return lambda (_, trail): (cont, trail)
-def KNip(cont): return lambda (entry, (_, trail)): (cont, (entry, trail))
-def KDup(cont): return lambda (entry, trail): (cont, (entry, (entry, trail)))
-
-def KAlter(fn, s):
-    return lambda ((vs,cs,ks), trail): (s, ((fn(*vs),cs,ks), trail))
-
-def KItem(ok, f, s):
-    return lambda ((vs,cs,ks), trail): (
-        (s, ((vs+(cs[0],), cs[1:], ks), trail)) if cs and ok(cs[0])
-        else (f, trail))
-
-def KCall(pr, name, f, s):
-    return lambda ((vs,cs,ks), trail): (
-        pr[name], ((vs,cs,((f,s),ks)), trail))
-def KFail():
-    return lambda ((vs,cs,((fk,_),ks)), trail): (fk, trail)
-def KSucceed():
-    return lambda ((vs,cs,((_,sk),ks)), trail): (sk, ((vs,cs,ks), trail))
+        pr.place(procs[name], DUP,
+                 translate(pr, procs, defn, pr.install(FAIL), pr.install(SUCCEED)))
+    return pr, entry, procs
+
+def run(q, defns, vs, cs, dbg=None):
+    pr, entry, _ = assemble(q, defns)
+    cx = parson._Parse(vals=parson._pushed(None, vs))
+    state = execute(pr.code, entry, cx, cs, 0, dbg)
+    if state is None: return 'fail'
+    cs, i, vals, _, _ = state
+    return parson._unwind(vals, None), cs[i:]
+
+
+# The bytecode. Each instruction is an opcode followed by its operands:
+# continuations (ints) and other constants, in one flat list. (It'd be
+# array('i') if not for the constants.) Since the instructions name
+# both their continuations, equal instructions can be shared.
+
+opnames = ('FINAL_FAIL FINAL_SUCCEED DROP CUT DUP CALL FAIL SUCCEED GO ITEM'
+           ' STAR_NEXT SAVE_FAR RESTORE_FAR OPEN CLOSE CLOSE_FEED MARK CAPTURE'
+           ' NEST NEST_FAIL UNNEST FEED ALTER PUSH POSITION LITERAL MATCH'
+           ' FUSED MEMO MEMO_FAIL MEMO_DONE SETTLE ENTER LEAVE LEAVE_FAIL').split()
+(FINAL_FAIL, FINAL_SUCCEED, DROP, CUT, DUP, CALL, FAIL, SUCCEED, GO, ITEM,
+ STAR_NEXT, SAVE_FAR, RESTORE_FAR, OPEN, CLOSE, CLOSE_FEED, MARK, CAPTURE,
+ NEST, NEST_FAIL, UNNEST, FEED, ALTER, PUSH, POSITION, LITERAL, MATCH,
+ FUSED, MEMO, MEMO_FAIL, MEMO_DONE, SETTLE, ENTER, LEAVE, LEAVE_FAIL) = range(len(opnames))
+
+arity = {FINAL_FAIL: 0, FINAL_SUCCEED: 0,
+         DROP: 1, CUT: 1, DUP: 1,           # (cont)
+         CALL: 3,                           # (procedure, fail_cont, success_cont)
+         FAIL: 0, SUCCEED: 0,
+         GO: 3, ITEM: 3,                    # (peg or ok, fail_cont, success_cont)
+         LITERAL: 3, MATCH: 3,              # (string or regex, fail_cont, success_cont)
+         FUSED: 3,                          # (regex, else_cont, success_cont)
+         STAR_NEXT: 2,                      # (loop_cont, success_cont)
+         SAVE_FAR: 1, RESTORE_FAR: 1, OPEN: 1, CLOSE: 1,
+         CLOSE_FEED: 2,                     # (fn, cont)
+         MARK: 1, CAPTURE: 1, POSITION: 1,
+         NEST: 2,                           # (cont, fail_cont)
+         NEST_FAIL: 1, UNNEST: 1,
+         FEED: 2, ALTER: 2, PUSH: 2,        # (fn or constant, cont)
+         MEMO: 4,                           # (memo peg, cont, fail_cont, success_cont)
+         MEMO_FAIL: 1, MEMO_DONE: 1, SETTLE: 1,
+         ENTER: 2, LEAVE: 2, LEAVE_FAIL: 2}  # (bracketed peg, cont)
+
+class Program(object):
+    "A growing list of instructions, sharing the equal ones."
+    def __init__(self):
+        self.code = []
+        self.installed = {}     # instruction -> its pc
+    def install(self, op, *operands):
+        # (Keyed by type too, so e.g. push(1) and push(True) stay apart.)
+        key = (op,) + tuple((type(x), x) for x in operands)
+        try: return self.installed[key]
+        except KeyError: pass
+        except TypeError: return self.place(self.reserve(op), op, *operands) # Unhashable.
+        self.installed[key] = pc = self.place(self.reserve(op), op, *operands)
+        return pc
+    def reserve(self, op):
+        "Make room for an op instruction, to place() once its operands are known."
+        pc = len(self.code)
+        self.code.extend([None] * (1 + arity[op]))
+        return pc
+    def place(self, pc, op, *operands):
+        assert len(operands) == arity[op]
+        self.code[pc:pc+1+len(operands)] = (op,) + operands
+        return pc
+    def listing(self):
+        pc = 0
+        while pc < len(self.code):
+            yield pc, show(self.code, pc)
+            pc += 1 + arity[self.code[pc]]
+
+def show(code, pc):
+    op = code[pc]
+    return '%s(%s)' % (opnames[op],
+                       ', '.join(_show_operand(x)
+                                 for x in code[pc+1:pc+1+arity[op]]))
+
+def _show_operand(x):
+    if isinstance(x, parson._Peg): return repr(x)
+    return x.__name__ if callable(x) else repr(x)
+
+def print_step(code, pc):
+    "A dbg hook for execute(), to trace it."
+    print 'pc', pc, 'insn', show(code, pc)
+
+
+# The parsing machine. Its state is in registers:
+# s: the subject sequence -- a string, list, buffer... -- and i our
+#    position in it. We never copy s; only a nest() changes it.
+# vals, base: the values stack and its frame base, as in parson's _Parse
+# ks: () | (frame, ks), for the calls, seclusions, captures, inversions
+#     and nestings we're inside of
+# The trail holds saved states (s,i,vals,base,ks) to backtrack to:
+# DUP pushes the current state, CUT commits to the current state by
+# discarding the last saved one, and DROP (as on any failure) goes back
+# to it. The parson _Parse cx travels alongside, for cx.far and the
+# memo tables of cx.memos.
+# Once a CUT (or the end of a star()'s time round) empties the trail,
+# we'll never again see a position before i, so we drop the memo
+# entries for them: a stream of items parsed by a star() at the top
+# then needs only as much memory as the biggest item.
+# A subroutine starts with a DUP, after CALL has pushed the call's
+# frame on ks, so that failing back to that state can find fail_cont.
+# With a Feeder (see below), s is the input so far, and an instruction
+# that would need to see past its end suspends the machine instead.
+
+def execute(code, pc, cx, s, i, dbg=None, feeder=None):
+    """Run code from pc on s starting at i. Return the final state
+    (s,i,vals,base,ks), or None on failure, or SUSPENDED if feeder
+    needs more input. dbg, if not None, gets called as dbg(code, pc)
+    before each step."""
+    vals, base, ks = cx.vals, cx.base, ()
+    trail = [(s, i, vals, base, ks)]    # (To fail back to from the top.)
+    more = feeder is not None and not feeder.closed   # More input may come.
+    if feeder is not None and feeder.suspended is not None:
+        pc, i, vals, base, ks, trail = feeder.resumed()
+    pop, push = trail.pop, trail.append
+    _unwind, _pushed, _slice = parson._unwind, parson._pushed, parson._slice
+    while True:
+        if dbg is not None: dbg(code, pc)
+        op = code[pc]
+        if op == GO:
+            if more and feeder.starved(s, i, code[pc+1]):
+                return feeder.suspend(pc, i, vals, base, ks, trail)
+            cx.vals, cx.base = vals, base
+            j = code[pc+1].go(s, i, cx)
+            if j < 0:
+                s, i, vals, base, ks = pop()
+                pc = code[pc+2]
+            else:
+                i, vals, pc = j, cx.vals, code[pc+3]
+        elif op == DUP:
+            push((s, i, vals, base, ks))
+            pc = code[pc+1]
+        elif op == LITERAL:
+            string = code[pc+1]
+            j = i + len(string)
+            if s[i:j] == string:
+                i = j
+                if cx.far < i: cx.far = i
+                pc = code[pc+3]
+            elif (more and len(s) < j and feeder.waiting(s)
+                  and s[i:] == string[:len(s)-i]):
+                return feeder.suspend(pc, i, vals, base, ks, trail)
+            else:
+                s, i, vals, base, ks = pop()
+                pc = code[pc+2]
+        elif op == MATCH:
+            m = code[pc+1].match(s, i)
+            if more and feeder.unsure(s, i, code[pc+1]):
+                return feeder.suspend(pc, i, vals, base, ks, trail)
+            if m is None:
+                s, i, vals, base, ks = pop()
+                pc = code[pc+2]
+            else:
+                i = m.end()
+                if cx.far < i: cx.far = i
+                if m.re.groups: vals = _pushed(vals, m.groups())
+                pc = code[pc+3]
+        elif op == FUSED:
+            # Like MATCH with no groups, but on a mismatch we go on to
+            # the code for the pegs the regex was made from, which will
+            # fail just the same but leave cx.far exact.
+            m = code[pc+1].match(s, i)
+            if m is None:
+                pc = code[pc+2]
+            elif more and feeder.unsure(s, i, code[pc+1]):
+                return feeder.suspend(pc, i, vals, base, ks, trail)
+            else:
+                i = m.end()
+                if cx.far < i: cx.far = i
+                pc = code[pc+3]
+        elif op == CALL:
+            ks = (code[pc+2], code[pc+3]), ks
+            pc = code[pc+1]
+        elif op == OPEN:
+            ks = base, ks
+            base = vals
+            pc = code[pc+1]
+        elif op == SUCCEED:
+            (_, pc), ks = ks
+            pop()
+        elif op == CLOSE:
+            base, ks = ks
+            pc = code[pc+1]
+        elif op == FAIL:
+            pc = ks[0][0]
+            s, i, vals, base, ks = pop()
+        elif op == CUT:
+            pop()
+            if len(trail) == 1:
+                if cx.memos: _forget_before(cx.memos, i)
+                if more: s, i, ks = feeder.rebased(s, i, vals, base, ks, trail)
+            pc = code[pc+1]
+        elif op == STAR_NEXT:
+            # Stop if that time round didn't advance, like parson's star().
+            pc = code[pc+1] if i != pop()[1] else code[pc+2]
+            if len(trail) == 1:
+                if cx.memos: _forget_before(cx.memos, i)
+                if more: s, i, ks = feeder.rebased(s, i, vals, base, ks, trail)
+        elif op == FEED:
+            vals = code[pc+1](*_unwind(vals, base)), base
+            pc = code[pc+2]
+        elif op == DROP:
+            s, i, vals, base, ks = pop()
+            pc = code[pc+1]
+        elif op == MARK:
+            ks = i, ks
+            pc = code[pc+1]
+        elif op == CAPTURE:
+            i0, ks = ks
+            vals = _slice(s, i0, i), vals
+            pc = code[pc+1]
+        elif op == CLOSE_FEED:
+            vals = code[pc+1](*_unwind(vals, base)), base
+            base, ks = ks
+            pc = code[pc+2]
+        elif op == ITEM:
+            if i < len(s) and code[pc+1](s[i]):
+                vals = s[i], vals
+                i += 1
+                if cx.far < i: cx.far = i
+                pc = code[pc+3]
+            elif more and len(s) <= i and feeder.waiting(s):
+                return feeder.suspend(pc, i, vals, base, ks, trail)
+            else:
+                s, i, vals, base, ks = pop()
+                pc = code[pc+2]
+        elif op == SAVE_FAR:
+            ks = cx.far, ks
+            pc = code[pc+1]
+        elif op == RESTORE_FAR:
+            cx.far, ks = ks
+            pc = code[pc+1]
+        elif op == ALTER:
+            vals = _pushed(base, code[pc+1](*_unwind(vals, base)))
+            pc = code[pc+2]
+        elif op == PUSH:
+            vals = code[pc+1], vals
+            pc = code[pc+2]
+        elif op == POSITION:
+            if feeder is not None and not feeder.depth:
+                vals = feeder.offset + i, vals
+            else:
+                vals = i, vals
+            pc = code[pc+1]
+        elif op == NEST:
+            if more and len(s) <= i and feeder.waiting(s):
+                return feeder.suspend(pc, i, vals, base, ks, trail)
+            try: item = s[i]
+            except IndexError: item = None
+            if item is None or not parson._is_indexable(item):
+                s, i, vals, base, ks = pop()
+                pc = code[pc+2]
+            else:
+                # Save the state inside, like a call, with the outer
+                # subject's frame.
+                ks = (s, i, cx.far, cx.memos), ks
+                s, i = item, 0
+                if feeder is not None: feeder.depth += 1
+                cx.far, cx.memos = 0, {}
+                push((s, i, vals, base, ks))
+                pc = code[pc+1]
+        elif op == NEST_FAIL:
+            _, _, cx.far, cx.memos = ks[0]
+            if feeder is not None: feeder.depth -= 1
+            s, i, vals, base, ks = pop()
+            pc = code[pc+1]
+        elif op == UNNEST:
+            (s, i, far, cx.memos), ks = ks
+            if feeder is not None: feeder.depth -= 1
+            i += 1
+            cx.far = max(far, i)
+            pop()
+            pc = code[pc+1]
+        elif op == MEMO:
+            # Like parson's memo(): an entry is good only for the same
+            # incoming values.
+            q = code[pc+1]
+            memos = parson._memo_table(cx, q, q.args[1])
+            entry = memos.get(i)
+            if entry is not None and entry[0] is vals and entry[1] is base:
+                _, _, j, memo_vals, far = entry
+                if cx.far < far: cx.far = far
+                if j < 0:
+                    s, i, vals, base, ks = pop()
+                    pc = code[pc+3]
+                else:
+                    i, vals = j, memo_vals
+                    pc = code[pc+4]
+            else:
+                # Save the state, like a call, with a frame for the entry.
+                ks = (memos, i, vals, base, cx.far), ks
+                cx.far = 0
+                push((s, i, vals, base, ks))
+                pc = code[pc+2]
+        elif op == MEMO_FAIL:
+            memos, j, memo_vals, memo_base, far = ks[0]
+            memos[j] = memo_vals, memo_base, -1, None, cx.far
+            cx.far = max(far, cx.far)
+            s, i, vals, base, ks = pop()
+            pc = code[pc+1]
+        elif op == MEMO_DONE:
+            (memos, j, memo_vals, memo_base, far), ks = ks
+            memos[j] = memo_vals, memo_base, i, vals, cx.far
+            cx.far = max(far, cx.far)
+            pop()
+            pc = code[pc+1]
+        elif op == SETTLE:
+            # Hand the feeder the values so far of the repetition it
+            # streams, once nothing can backtrack over them.
+            pc = code[pc+1]
+            if len(trail) == 1 and vals is not base:
+                feeder.settled = _unwind(vals, base)
+                return feeder.suspend(pc, i, base, base, ks, trail)
+        elif op == ENTER:
+            # A peg that watches its own runs, like a profiled rule,
+            # keeps what it'll need on leaving on a stack of its own, not
+            # on ks: failing restores ks from before we entered. (Runs
+            # leave just once each, in order, so a stack serves.)
+            offset = feeder.offset if feeder is not None and not feeder.depth else 0
+            code[pc+1].args[2][0](cx, i, offset)
+            pc = code[pc+2]
+        elif op == LEAVE:
+            offset = feeder.offset if feeder is not None and not feeder.depth else 0
+            code[pc+1].args[2][1](cx, i, offset)
+            pc = code[pc+2]
+        elif op == LEAVE_FAIL:
+            offset = feeder.offset if feeder is not None and not feeder.depth else 0
+            code[pc+1].args[2][1](cx, -1, offset)
+            pc = code[pc+2]
+        elif op == FINAL_SUCCEED:
+            return s, i, vals, base, ks
+        elif op == FINAL_FAIL:
+            return None
+        else:
+            assert False, op
+
+def _forget_before(memos, i):
+    "Drop the memo entries for positions before i."
+    for table in memos.values():
+        for j in [j for j in table if j < i]:
+            del table[j]
+
+
+# A backend for real parson pegs: vm(peg) makes a peg that parses like
+# peg, but with its control on the heap, so deeply nested inputs can't
+# overflow the Python stack. A grammar rule (a delay()) becomes a
+# subroutine. Literals and regexes become instructions of their own;
+# the other simple pegs that don't call others (one_that(), ...) each
+# run as one GO instruction, by calling their own go().
+
+def vm(peg, dbg=None):
+    """Return a peg that acts just like peg but runs on this machine,
+    without recursion. dbg is as for execute()."""
+    pr, entry = _translated(peg)
+    code = pr.code
+    def go(s, i, cx):
+        state = execute(code, entry, cx, s, i, dbg)
+        if state is None: return -1
+        _, i, cx.vals, _, _ = state
+        return i
+    q = peg.__class__(peg.face, None, peg.op, peg.args, go)
+    q.program = pr
+    return q
+
+def _translated(peg, streaming=False):
+    """Return a Program for peg, and its entry point. If streaming, its
+    outermost repetition hands out its values as they settle."""
+    # A memo() around the whole parse would never pay off, and its saved
+    # state would keep the trail from ever emptying, so we skip it.
+    while peg.op in ('label', 'memo'): peg = peg.args[0]
+    stream = None
+    if streaming:
+        stream = _repetition(peg)
+        if stream is None: raise ValueError("No repetition to stream", peg)
+    pr = Program()
+    entry = translate_peg(pr, {}, peg,
+                          pr.install(FINAL_FAIL), pr.install(FINAL_SUCCEED), stream)
+    return pr, entry
+
+def translate_peg(pr, procs, peg, f, s, stream=None):
+    """Return the entry point of code for peg, continuing to f on
+    failure and to s on success. procs maps each rule reached so far to
+    its subroutine's entry. stream, if reached, is the repetition to
+    settle the values of."""
+    def tr(p, f, s): return translate_peg(pr, procs, p, f, s, stream)
+    if peg is stream: return translate_stream(pr, procs, peg, f, s)
+    op, args = peg.op, peg.args
+    if op == 'label':
+        return tr(args[0], f, s)
+    elif op == 'memo':
+        return pr.install(MEMO, peg,
+                          tr(args[0], pr.install(MEMO_FAIL, f), pr.install(MEMO_DONE, s)),
+                          f, s)
+    elif op == 'delay':
+        target = parson._forced(peg)
+        if target not in procs:
+            procs[target] = pr.reserve(DUP)
+            pr.place(procs[target], DUP,
+                     translate_peg(pr, procs, target,
+                                   pr.install(FAIL), pr.install(SUCCEED)))
+        return pr.install(CALL, procs[target], f, s)
+    elif op == 'fail':     return pr.install(DROP, f)
+    elif op == 'chain':    return tr(args[0], f, tr(args[1], f, s))
+    elif op == 'either':
+        return pr.install(DUP, tr(args[0], tr(args[1], f, s), pr.install(CUT, s)))
+    elif op == 'invert':
+        if parson._is_fail(args[0]): return s
+        return pr.install(SAVE_FAR,
+                          pr.install(DUP,
+                                     tr(args[0],
+                                        pr.install(RESTORE_FAR, s),
+                                        pr.install(DROP,
+                                                   pr.install(RESTORE_FAR,
+                                                              pr.install(DROP, f))))))
+    elif op == 'star':
+        loop = pr.reserve(DUP)
+        return pr.place(loop, DUP, tr(args[0], s, pr.install(STAR_NEXT, loop, s)))
+    elif op == 'seclude':
+        return pr.install(OPEN, tr(args[0], f, pr.install(CLOSE, s)))
+    elif op == 'fed':
+        return pr.install(OPEN, tr(args[0], f, pr.install(CLOSE_FEED, args[1], s)))
+    elif op == 'capture':
+        return pr.install(MARK, tr(args[0], f, pr.install(CAPTURE, s)))
+    elif op == 'nest':
+        return pr.install(NEST,
+                          tr(args[0], pr.install(NEST_FAIL, f), pr.install(UNNEST, s)),
+                          f)
+    elif op == 'feed':     return pr.install(FEED, args[0], s)
+    elif op == 'alter':    return pr.install(ALTER, args[0], s)
+    elif op == 'push':     return pr.install(PUSH, args[0], s)
+    elif op == 'position': return pr.install(POSITION, s)
+    elif op == 'literal':
+        if parson._high_bytes(args[0]):
+            return pr.install(MATCH, re.compile(re.escape(args[0])), f, s)
+        return pr.install(LITERAL, args[0], f, s)
+    elif op == 'match':    return pr.install(MATCH, re.compile(args[0]), f, s)
+    elif op == 'fused':
+        return pr.install(FUSED, re.compile(parson._named_groups(args[0])),
+                          tr(args[1], f, s), s)
+    elif op in _bracketed:
+        return pr.install(ENTER, peg,
+                          tr(args[0], pr.install(LEAVE_FAIL, peg, f),
+                             pr.install(LEAVE, peg, s)))
+    else:
+        return pr.install(GO, peg, f, s)
+
+# The ops of pegs with enter() and leave() hooks to bracket their runs,
+# as parson's profiled rules and watched alternatives do. The hooks are
+# the last of their args, as a pair.
+_bracketed = ('profiled', 'watched')
+
+# The repetitions we can stream: p*, p q* (as in p+ and p++sep), and
+# (p q*)|r (as in p**sep). The values go in a seclusion of their own,
+# and a SETTLE after each time round hands them on if the trail is
+# empty then. For the last form we commit to the first alternative as
+# soon as p matches, since q* can't fail. Each time round also runs
+# in a seclusion of its own, so it acts the same whether or not the
+# values before it were handed on yet. The first alternative of the
+# last form may be bracketed, as by a watched() alternative; then the
+# brackets go around p and the whole of q*.
+
+def _stream_parts(peg):
+    """Return (p, q, r, brackets) for a repetition as above, with None
+    for absent parts, and brackets the bracketed pegs around (p q*),
+    outermost first; or None."""
+    peg = parson._unlabeled(peg)
+    if peg.op == 'star':
+        return None, peg.args[0], None, ()
+    if peg.op == 'chain' and parson._unlabeled(peg.args[1]).op == 'star':
+        return peg.args[0], parson._unlabeled(peg.args[1]).args[0], None, ()
+    if peg.op == 'either':
+        first, brackets = parson._unlabeled(peg.args[0]), []
+        while first.op in _bracketed:
+            brackets.append(first)
+            first = parson._unlabeled(first.args[0])
+        parts = _stream_parts(first)
+        if parts is not None and parts[0] is not None and parts[2] is None:
+            return parts[0], parts[1], peg.args[1], tuple(brackets)
+    return None
+
+def _repetition(peg):
+    "Return the outermost streamable repetition of peg's own, or None."
+    if _stream_parts(peg) is not None: return peg
+    if peg.op in ('label', 'memo', 'seclude', 'fed') or peg.op in _bracketed:
+        return _repetition(peg.args[0])
+    if peg.op == 'chain':
+        return _repetition(peg.args[0]) or _repetition(peg.args[1])
+    return None
+
+def translate_stream(pr, procs, peg, f, s):
+    def tr(p, f, s): return translate_peg(pr, procs, p, f, s)
+    def item(p, f, s): return pr.install(OPEN, tr(p, f, pr.install(CLOSE, s)))
+    p, q, r, brackets = _stream_parts(peg)
+    done = s
+    for b in brackets: done = pr.install(LEAVE, b, done)
+    close = pr.install(SETTLE, pr.install(CLOSE, done))
+    loop = pr.reserve(DUP)
+    pr.place(loop, DUP, item(q, close, pr.install(STAR_NEXT, pr.install(SETTLE, loop), close)))
+    if p is None:
+        return pr.install(OPEN, loop)
+    elif r is None:
+        return pr.install(OPEN, item(p, f, pr.install(SETTLE, loop)))
+    else:
+        otherwise = tr(r, f, s)
+        for b in brackets: otherwise = pr.install(LEAVE_FAIL, b, otherwise)
+        start = pr.install(OPEN,
+                           item(p, otherwise,
+                                pr.install(CUT, pr.install(SETTLE, loop))))
+        for b in reversed(brackets): start = pr.install(ENTER, b, start)
+        return pr.install(DUP, start)
+
+
+# Push parsing: a Feeder runs a peg on the machine above over input
+# that arrives a chunk at a time. When an instruction would need to see
+# past the end of the input so far, the machine suspends, saving its
+# registers, and a later feed() resumes it on the longer input. (A
+# simple peg run by GO gets to go only once it has all the input it
+# might look at -- for most kinds, until close().)
+# Whenever the trail empties, as between the items of a star() at the
+# top, we drop the input before i (or before an open capture()), so
+# we hold just the unconsumed tail plus what backtracking may revisit.
+# (Once closed, the input can't grow, so we leave it be.) Only then:
+# inside any rule call, the call's own DUP keeps the trail from
+# emptying, so a peg like json_parse.value, with no repetition at the
+# top, holds all its input till it's done.
+# Adding a chunk copies the input held, so while we can't drop any and
+# it's grown big, feed() holds back chunks, unparsed, till they add up
+# to as much again: that keeps the copying linear in the input, at the
+# price of values and failures that may show up later than they could.
+
+SUSPENDED = 'suspended'
+
+class Feeder(object):
+    """A push parser for peg: feed() it the input a chunk at a time,
+    then close() it to get the tuple of values. If streaming, the
+    values of peg's outermost repetition come out as they settle
+    instead, from feed() and close() both; peg's other values are
+    dropped."""
+
+    def __init__(self, peg, dbg=None, streaming=False):
+        self.peg = peg
+        self.program, self.entry = _translated(peg, streaming)
+        self.streaming = streaming
+        self.dbg = dbg
+        self.cx = parson._Parse()
+        self.buffer = None      # The input that's left, from offset on.
+        self.held = []          # Chunks fed but not yet added to it,
+        self.held_size = 0      # and their total length.
+        self.offset = 0         # How much input we've dropped.
+        self.newlines = 0       # How many newlines it held,
+        self.line_start = 0     # and where the line after the last starts.
+        self.closed = False
+        self.depth = 0          # How many nest()s deep the machine is.
+        self.suspended = None   # (pc, i, vals, base, ks, trail) or None
+        self.state = SUSPENDED  # Else execute()'s final state or None.
+        self.settled = ()       # Values just handed out by a SETTLE.
+
+    def feed(self, chunk):
+        """Add chunk to the input and parse as far as we can, unless it
+        pays to hold the chunk back (see above). Return a list of the
+        values settled meanwhile, if streaming."""
+        assert not self.closed, "Already closed"
+        values = []
+        if self.state is SUSPENDED:
+            if self.buffer is None:
+                self.buffer = chunk
+            else:
+                self.held.append(chunk)
+                self.held_size += len(chunk)
+            if self.worth_running():
+                values = list(self.settling())
+        self.check()
+        return values
+
+    def worth_running(self):
+        "Should feed() run the machine now, or hold back the new input?"
+        if self.suspended is None or len(self.suspended[5]) == 1:
+            return True         # (It may get to drop input.)
+        return len(self.buffer) <= max(self.held_size, _cheap_to_copy)
+
+    def close(self):
+        """Finish the parse and return the tuple of values (the rest of
+        them, if streaming), or raise Unparsable."""
+        values = tuple(self.closing())
+        if self.streaming: return values
+        return parson._unwind(self.state[2], None)
+
+    def closing(self):
+        "Like close(), but yield each value as it settles."
+        if not self.closed:
+            self.closed = True
+            if self.buffer is None: self.buffer = ''
+            for value in self.settling():
+                yield value
+        self.check()
+
+    def settling(self):
+        "Run as far as the input allows, yielding each value as it settles."
+        while self.state is SUSPENDED:
+            self.run()
+            if not self.settled: break   # (Done, or starved for input.)
+            for value in self.settled: yield value
+
+    def run(self):
+        if self.held:
+            self.buffer = _joined([self.buffer] + self.held)
+            self.held, self.held_size = [], 0
+        self.settled = ()
+        self.state = execute(self.program.code, self.entry, self.cx,
+                             self.buffer, 0, self.dbg, self)
+        if self.state is not SUSPENDED:
+            self.suspended = None
+            self.cx.memos = {}
+
+    def check(self):
+        if self.state is None:
+            # (The position counts from the start of all the input, as
+            # the position peg does, and the input before it that we
+            # dropped goes in the exception's offset.)
+            raise parson.Unparsable.at(self.peg, self.buffer, self.cx.far,
+                                       self.offset,
+                                       self.newlines, self.line_start)
+
+    # The machine's side:
+
+    def waiting(self, s):
+        "Might more of s be on the way?"
+        # (s is the input, if not nested. We can't just ask if s is
+        # self.buffer: nesting into 'a' from 'a' would get the same s.)
+        return not self.depth and not self.closed
+
+    def starved(self, s, i, peg):
+        "Must peg, run at s[i:], see more of s than we have?"
+        if not self.waiting(s): return False
+        reach = _reaches.get(peg.op)
+        return reach is None or len(s) < i + reach
+
+    def unsure(self, s, i, regex):
+        "Could regex match differently at s[i:] if s went on?"
+        return self.waiting(s) and _viable(regex).match(s, i) is not None
+
+    def suspend(self, pc, i, vals, base, ks, trail):
+        self.suspended = pc, i, vals, base, ks, trail
+        return SUSPENDED
+
+    def resumed(self):
+        "Return the suspended registers, with the new, longer input."
+        pc, i, vals, base, ks, trail = self.suspended
+        s = self.buffer
+        # (Not nested, as we must be, every saved s is the input.)
+        trail = [(s,) + saved[1:] for saved in trail]
+        return pc, i, vals, base, ks, trail
+
+    def rebased(self, s, i, vals, base, ks, trail):
+        """The trail is down to its bottom state: drop the input before
+        i, if it's worth the copying. Return the new (s, i, ks)."""
+        if self.depth or len(s) > 2 * i: return s, i, ks
+        # At this point the only ints on ks are the starts of captures.
+        frames = []
+        while ks:
+            frame, ks = ks
+            frames.append(frame)
+        cut = min([i] + [frame for frame in frames if isinstance(frame, int)])
+        for frame in reversed(frames):
+            ks = (frame - cut if isinstance(frame, int) else frame), ks
+        if 0 < cut:
+            if isinstance(s, (str, unicode)):
+                newlines = s.count('\n', 0, cut)
+                if newlines:
+                    self.newlines += newlines
+                    self.line_start = self.offset + s.rfind('\n', 0, cut) + 1
+            s, i = s[cut:], i - cut
+            self.buffer, self.offset = s, self.offset + cut
+            self.cx.far = max(0, self.cx.far - cut)
+            self.cx.memos = {}  # (Their keys are the old positions.)
+            trail[0] = s, i, vals, base, ks
+        return s, i, ks
+
+# (Next to a run of the machine, copying a buffer this big costs little.)
+_cheap_to_copy = 1 << 14
+
+def _joined(parts):
+    "Concatenate the sequences parts, copying each just once."
+    if isinstance(parts[0], (str, unicode)): return parts[0][:0].join(parts)
+    if isinstance(parts[0], list):
+        joined = []
+        for part in parts: joined.extend(part)
+        return joined
+    return reduce(lambda s, part: s + part, parts)
+
+def stream(peg, chunks):
+    """Parse the input from chunks, an iterable of strings (like a file,
+    or a socket's recv()s), yielding each value of peg's outermost
+    repetition as soon as it settles."""
+    feeder = Feeder(peg, streaming=True)
+    for chunk in chunks:
+        for value in feeder.feed(chunk):
+            yield value
+    for value in feeder.close():
+        yield value
+
+def iterparse(peg, sequence):
+    """Parse a prefix of sequence, yielding each value of peg's
+    outermost repetition as soon as it's parsed, and keeping no values
+    or memo entries we're done with; or raise Unparsable."""
+    feeder = Feeder(peg, streaming=True)
+    feeder.buffer = sequence
+    return feeder.closing()
+
+# How far past i each kind of simple peg may look, or, if not listed,
+# maybe any distance.
+_reaches = {'one_that': 1, 'one_of': 1, 'trace': 0}
+
+# Given a compiled regex R, _viable(R) is a regex that matches at i,
+# through the end of s, just when R.match(s, i) might come out
+# differently given more of s: that is, when s[i:] is a proper prefix
+# of some string R could match there, or ends where R might test what
+# comes next (for $, \b, or a lookahead). We make it by rewriting the
+# sre_parse tree of R. Where that's not exact, it errs toward matching.
+
+_viables = {}
+
+def _viable(regex):
+    try: return _viables[regex]
+    except KeyError: pass
+    parsed = sre_parse.parse(regex.pattern, regex.flags)
+    groups = {}
+    _note_groups(parsed.data, groups)
+    prefixes = _prefixes(parsed.data, groups)
+    if prefixes is None: prefixes = [(sre_constants.ASSERT_NOT, (1, _sub([])))]
+    pattern = sre_parse.Pattern()
+    pattern.flags = regex.flags
+    _viables[regex] = viable = sre_compile.compile(
+        sre_parse.SubPattern(pattern,
+                             prefixes + [(sre_constants.AT, sre_constants.AT_END_STRING)]),
+        regex.flags)
+    return viable
+
+def _sub(items):
+    return sre_parse.SubPattern(_pattern, items)
+_pattern = sre_parse.Pattern()
+
+def _note_groups(items, groups):
+    "Map each group number to its items in groups."
+    for op, av in items:
+        if op == sre_constants.SUBPATTERN:
+            groups[av[0]] = av[1]
+        for sub in _sre_kids(op, av):
+            _note_groups(sub, groups)
+
+def _sre_kids(op, av):
+    if op in (sre_constants.SUBPATTERN, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return [av[1]]
+    elif op == sre_constants.BRANCH:
+        return av[1]
+    elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+        return [av[2]]
+    elif op == sre_constants.GROUPREF_EXISTS:
+        return [sub for sub in av[1:] if sub is not None]
+    else:
+        return []
+
+def _prefixes(items, groups):
+    """Return sre items matching the proper prefixes of what the
+    sequence items matches (as above), or None if there are none."""
+    result = None
+    for op, av in reversed(items):
+        rest = None if result is None else [_whole(op, av, groups)] + result
+        result = _either(_item_prefixes(op, av, groups), rest)
+    return result
+
+def _item_prefixes(op, av, groups):
+    if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL,
+              sre_constants.IN, sre_constants.ANY):
+        return []
+    elif op == sre_constants.AT:
+        if av in (sre_constants.AT_BEGINNING, sre_constants.AT_BEGINNING_LINE,
+                  sre_constants.AT_BEGINNING_STRING):
+            return None
+        return []
+    elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        if av[0] < 0: return None   # A lookbehind
+        return _prefixes(av[1], groups)
+    elif op == sre_constants.SUBPATTERN:
+        return _prefixes(av[1], groups)
+    elif op == sre_constants.BRANCH:
+        return reduce(_either, [_prefixes(alt, groups) for alt in av[1]])
+    elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+        lo, hi, body = av
+        prefixes = _prefixes(body, groups)
+        if hi == 0 or prefixes is None: return None
+        return [(sre_constants.MAX_REPEAT,
+                 (0, sre_constants.MAXREPEAT, _sub(_wholes(body, groups))))] + prefixes
+    elif op == sre_constants.GROUPREF:
+        return _prefixes(groups[av], groups)
+    elif op == sre_constants.GROUPREF_EXISTS:
+        return reduce(_either, [_prefixes(sub, groups) for sub in av[1:] if sub is not None])
+    else:
+        # Anything at all:
+        return [(sre_constants.MAX_REPEAT,
+                 (0, sre_constants.MAXREPEAT,
+                  _sub([(sre_constants.IN, [(sre_constants.NEGATE, None)])])))]
+
+def _either(items1, items2):
+    if items1 is None: return items2
+    if items2 is None: return items1
+    return [(sre_constants.BRANCH, (None, [_sub(items1), _sub(items2)]))]
+
+def _wholes(items, groups):
+    "Return sre items matching what items does, but with no groups or backrefs."
+    return [_whole(op, av, groups) for op, av in items]
+
+def _whole(op, av, groups):
+    if op == sre_constants.SUBPATTERN:
+        return op, (None, _sub(_wholes(av[1], groups)))
+    elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return op, (av[0], _sub(_wholes(av[1], groups)))
+    elif op == sre_constants.BRANCH:
+        return op, (None, [_sub(_wholes(alt, groups)) for alt in av[1]])
+    elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+        return op, (av[0], av[1], _sub(_wholes(av[2], groups)))
+    elif op == sre_constants.GROUPREF:
+        return sre_constants.SUBPATTERN, (None, _sub(_wholes(groups[av], groups)))
+    elif op == sre_constants.GROUPREF_EXISTS:
+        return sre_constants.BRANCH, (None, [_sub(_wholes(sub or [], groups))
+                                             for sub in av[1:]])
+    else:
+        return op, av
 
 
 # Smoke test
@@ -149,88 +921,109 @@ def test(string):
 #    return run(Lit('0'), (), string)
 #    return run(bit, (), string)
 #    return run(twobits, {}, (), string)
-    return run(Ref('nbits'), nbits_defs, (), string)
+    pr, _, procs = assemble(Ref('nbits'), nbits_defs)
+    for name in sorted(procs.keys()):
+        print name, '=>', procs[name]
+    for pc, insn in pr.listing():
+        print pc, insn
+    return run(Ref('nbits'), nbits_defs, (), string, print_step)
 
 ## test('xy')
-#. nbits => 12
-#. 0 KFinalFail()
-#. 1 KFinalSucceed()
-#. 2 KCall({'nbits': 12}, 'nbits', 0, 1)
-#. 3 KFail()
-#. 4 KSucceed()
-#. 5 KCall({'nbits': 12}, 'nbits', 3, 4)
-#. 6 KNip(5)
-#. 7 KAlter(identity, 4)
-#. 8 KNip(6)
-#. 9 KItem(eq '1', 7, 6)
-#. 10 KItem(eq '0', 9, 8)
-#. 11 KDup(10)
-#. 12 KDup(11)
-#. pc 2 insn KCall({'nbits': 12}, 'nbits', 0, 1)
-#. pc 12 insn KDup(11)
-#. pc 11 insn KDup(10)
-#. pc 10 insn KItem(eq '0', 9, 8)
-#. pc 9 insn KItem(eq '1', 7, 6)
-#. pc 7 insn KAlter(identity, 4)
-#. pc 4 insn KSucceed()
-#. pc 1 insn KFinalSucceed()
+#. nbits => 0
+#. 0 DUP(31)
+#. 2 FINAL_FAIL()
+#. 3 FINAL_SUCCEED()
+#. 4 CALL(0, 2, 3)
+#. 8 FAIL()
+#. 9 SUCCEED()
+#. 10 CALL(0, 8, 9)
+#. 14 CUT(10)
+#. 16 ALTER(identity, 9)
+#. 19 CUT(14)
+#. 21 ITEM(eq '1', 16, 14)
+#. 25 ITEM(eq '0', 21, 19)
+#. 29 DUP(25)
+#. 31 DUP(29)
+#. pc 4 insn CALL(0, 2, 3)
+#. pc 0 insn DUP(31)
+#. pc 31 insn DUP(29)
+#. pc 29 insn DUP(25)
+#. pc 25 insn ITEM(eq '0', 21, 19)
+#. pc 21 insn ITEM(eq '1', 16, 14)
+#. pc 16 insn ALTER(identity, 9)
+#. pc 9 insn SUCCEED()
+#. pc 3 insn FINAL_SUCCEED()
 #. ((), 'xy')
 ## test('01101a')
-#. nbits => 12
-#. 0 KFinalFail()
-#. 1 KFinalSucceed()
-#. 2 KCall({'nbits': 12}, 'nbits', 0, 1)
-#. 3 KFail()
-#. 4 KSucceed()
-#. 5 KCall({'nbits': 12}, 'nbits', 3, 4)
-#. 6 KNip(5)
-#. 7 KAlter(identity, 4)
-#. 8 KNip(6)
-#. 9 KItem(eq '1', 7, 6)
-#. 10 KItem(eq '0', 9, 8)
-#. 11 KDup(10)
-#. 12 KDup(11)
-#. pc 2 insn KCall({'nbits': 12}, 'nbits', 0, 1)
-#. pc 12 insn KDup(11)
-#. pc 11 insn KDup(10)
-#. pc 10 insn KItem(eq '0', 9, 8)
-#. pc 8 insn KNip(6)
-#. pc 6 insn KNip(5)
-#. pc 5 insn KCall({'nbits': 12}, 'nbits', 3, 4)
-#. pc 12 insn KDup(11)
-#. pc 11 insn KDup(10)
-#. pc 10 insn KItem(eq '0', 9, 8)
-#. pc 9 insn KItem(eq '1', 7, 6)
-#. pc 6 insn KNip(5)
-#. pc 5 insn KCall({'nbits': 12}, 'nbits', 3, 4)
-#. pc 12 insn KDup(11)
-#. pc 11 insn KDup(10)
-#. pc 10 insn KItem(eq '0', 9, 8)
-#. pc 9 insn KItem(eq '1', 7, 6)
-#. pc 6 insn KNip(5)
-#. pc 5 insn KCall({'nbits': 12}, 'nbits', 3, 4)
-#. pc 12 insn KDup(11)
-#. pc 11 insn KDup(10)
-#. pc 10 insn KItem(eq '0', 9, 8)
-#. pc 8 insn KNip(6)
-#. pc 6 insn KNip(5)
-#. pc 5 insn KCall({'nbits': 12}, 'nbits', 3, 4)
-#. pc 12 insn KDup(11)
-#. pc 11 insn KDup(10)
-#. pc 10 insn KItem(eq '0', 9, 8)
-#. pc 9 insn KItem(eq '1', 7, 6)
-#. pc 6 insn KNip(5)
-#. pc 5 insn KCall({'nbits': 12}, 'nbits', 3, 4)
-#. pc 12 insn KDup(11)
-#. pc 11 insn KDup(10)
-#. pc 10 insn KItem(eq '0', 9, 8)
-#. pc 9 insn KItem(eq '1', 7, 6)
-#. pc 7 insn KAlter(identity, 4)
-#. pc 4 insn KSucceed()
-#. pc 4 insn KSucceed()
-#. pc 4 insn KSucceed()
-#. pc 4 insn KSucceed()
-#. pc 4 insn KSucceed()
-#. pc 4 insn KSucceed()
-#. pc 1 insn KFinalSucceed()
+#. nbits => 0
+#. 0 DUP(31)
+#. 2 FINAL_FAIL()
+#. 3 FINAL_SUCCEED()
+#. 4 CALL(0, 2, 3)
+#. 8 FAIL()
+#. 9 SUCCEED()
+#. 10 CALL(0, 8, 9)
+#. 14 CUT(10)
+#. 16 ALTER(identity, 9)
+#. 19 CUT(14)
+#. 21 ITEM(eq '1', 16, 14)
+#. 25 ITEM(eq '0', 21, 19)
+#. 29 DUP(25)
+#. 31 DUP(29)
+#. pc 4 insn CALL(0, 2, 3)
+#. pc 0 insn DUP(31)
+#. pc 31 insn DUP(29)
+#. pc 29 insn DUP(25)
+#. pc 25 insn ITEM(eq '0', 21, 19)
+#. pc 19 insn CUT(14)
+#. pc 14 insn CUT(10)
+#. pc 10 insn CALL(0, 8, 9)
+#. pc 0 insn DUP(31)
+#. pc 31 insn DUP(29)
+#. pc 29 insn DUP(25)
+#. pc 25 insn ITEM(eq '0', 21, 19)
+#. pc 21 insn ITEM(eq '1', 16, 14)
+#. pc 14 insn CUT(10)
+#. pc 10 insn CALL(0, 8, 9)
+#. pc 0 insn DUP(31)
+#. pc 31 insn DUP(29)
+#. pc 29 insn DUP(25)
+#. pc 25 insn ITEM(eq '0', 21, 19)
+#. pc 21 insn ITEM(eq '1', 16, 14)
+#. pc 14 insn CUT(10)
+#. pc 10 insn CALL(0, 8, 9)
+#. pc 0 insn DUP(31)
+#. pc 31 insn DUP(29)
+#. pc 29 insn DUP(25)
+#. pc 25 insn ITEM(eq '0', 21, 19)
+#. pc 19 insn CUT(14)
+#. pc 14 insn CUT(10)
+#. pc 10 insn CALL(0, 8, 9)
+#. pc 0 insn DUP(31)
+#. pc 31 insn DUP(29)
+#. pc 29 insn DUP(25)
+#. pc 25 insn ITEM(eq '0', 21, 19)
+#. pc 21 insn ITEM(eq '1', 16, 14)
+#. pc 14 insn CUT(10)
+#. pc 10 insn CALL(0, 8, 9)
+#. pc 0 insn DUP(31)
+#. pc 31 insn DUP(29)
+#. pc 29 insn DUP(25)
+#. pc 25 insn ITEM(eq '0', 21, 19)
+#. pc 21 insn ITEM(eq '1', 16, 14)
+#. pc 16 insn ALTER(identity, 9)
+#. pc 9 insn SUCCEED()
+#. pc 9 insn SUCCEED()
+#. pc 9 insn SUCCEED()
+#. pc 9 insn SUCCEED()
+#. pc 9 insn SUCCEED()
+#. pc 9 insn SUCCEED()
+#. pc 3 insn FINAL_SUCCEED()
 #. (('0', '1', '1', '0', '1'), 'a')
+
+
+# The old machine's subject can be any sequence too:
+## run(Chain(Literal('01'), Regex('(1*)(0)')), {}, (), buffer('01110x'))
+#. (('11', '0'), 'x')
+## run(Ref('nbits'), nbits_defs, (), list('01101a'))
+#. (('0', '1', '1', '0', '1'), ['a'])
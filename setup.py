@@ -6,7 +6,7 @@ setup(name = 'Parson',
       version = version,
       author = 'Darius Bacon',
       author_email = 'darius@wry.me',
-      py_modules = ['parson'],
+      py_modules = ['parson', 'pegvm'],
       url = 'https://github.com/darius/parson',
       description = "A fancier parsing package.", # XXX
       long_description = open('README.md').read(),
@@ -149,6 +149,11 @@ def foldr(f, z, xs):
 ## exceptionally(lambda: Grammar(r"a = ")())
 #. GrammarError('Bad grammar', ('a = ', ''))
 
+## exceptionally(lambda: Grammar(r"'' op :end. op: /(a)/. first: .")())
+#. GrammarError('Rule names taken by the start rule: first, op',)
+## Grammar(r"op: /(a)/. first: .")().op('a')
+#. ('a',)
+
 pushy = Grammar(r"""
 main: :'x'.
 """)()
@@ -195,6 +200,48 @@ def catch_position(parse, string):
 ## catch_position(Grammar(r" 'x'* /$/ ")(), 'xxxhi')
 #. 3
 
+# A failed parse notes where, and slices up the input only if asked:
+xs = Grammar(r" 'x'* /$/ ")()
+
+class Sliced(str):
+    "A str that counts the slices taken of it."
+    slices = 0
+    def __getslice__(self, i, j):
+        Sliced.slices += 1
+        return str.__getslice__(self, i, j)
+
+def slices_taken(thunk):
+    "Return thunk's result and how many Sliced slices it took."
+    Sliced.slices = 0
+    result = thunk()
+    return result, Sliced.slices
+
+## e = exceptionally(lambda: xs(Sliced('xxxhi')))
+## slices_taken(lambda: (e.position, e.offset, e.line, e.column))
+#. ((3, 0, 1, 3), 0)
+## slices_taken(lambda: e.failure)
+#. (('xxx', 'hi'), 2)
+## e = exceptionally(lambda: xs('xxxhi'))
+## e.failure, e
+#. (('xxx', 'hi'), Unparsable((literal('') ((literal('x'))* /$/)), 'xxx', 'hi'))
+## e.position, e.offset, Unparsable(xs, 'xx', 'y').offset
+#. (3, 0, 0)
+## xs.attempt('xxxhi'), xs.attempt('xxx')
+#. (None, ())
+
+# It knows its line and column, too:
+## e = exceptionally(lambda: xs('xx\nx')); e.line, e.column
+#. (1, 2)
+## e = exceptionally(lambda: (match(r'[x\n]*') + end)('xx\nxx\n\nxhi')); e.line, e.column, e.position
+#. (4, 1, 8)
+
+from parson import LineIndex
+lines = LineIndex('ab\nc\n\nd')
+## [lines.locate(i) for i in range(8)]
+#. [(1, 0), (1, 1), (1, 2), (2, 0), (2, 1), (3, 0), (4, 0), (4, 1)]
+## [lines.bounds(n) for n in (1, 2, 3, 4)]
+#. [(0, 2), (3, 4), (5, 5), (6, 7)]
+
 
 # Like test2, but in the grammar syntax and using immediate actions
 # instead of folds:
@@ -257,3 +304,659 @@ test3 = test3_grammar(**globals()).start.expecting_one_result()
 
 ## test3('\\a b c . a b')
 #. '(lambda (a) (lambda (b) (lambda (c) (a b))))'
+
+
+# Smoke test: packrat memoization
+
+n_words = [0]
+def counted_word(word):
+    n_words[0] += 1
+    return word
+
+shared_prefix = Grammar(r"""
+main: word '!' | word '?'.
+word: /(\w+)/ :counted_word.
+""")
+
+def count_word_calls(rules, string):
+    n_words[0] = 0
+    return rules.main(string), n_words[0]
+
+## count_word_calls(shared_prefix(counted_word=counted_word), 'hi?')
+#. (('hi',), 2)
+## count_word_calls(shared_prefix.bind(globals(), packrat=True), 'hi?')
+#. (('hi',), 1)
+## count_word_calls(shared_prefix.bind(globals(), packrat=lru(1)), 'hi?')
+#. (('hi',), 1)
+
+## catch_position(shared_prefix.bind(globals(), packrat=True).main, 'hi.')
+#. 2
+
+## memoized_x = memo(match(r'(x)'))
+## (memoized_x + memoized_x)('xx')
+#. ('x', 'x')
+## ((memoized_x + 'y') | (memoized_x + 'z'))('xz')
+#. ('x',)
+## ~memoized_x + match(r'(.)') | match(r'x(.)')
+#. ((!(memo(/(x)/)) /(.)/)|/x(.)/)
+## (~memoized_x + match(r'(.)') | match(r'x(.)'))('xy')
+#. ('y',)
+
+
+# Smoke test: compiling to Python
+
+from parson import compile
+
+## compiled_star = compile(match(r'(.)').star() >> join)
+## compiled_star
+#. ((/(.)/)*>>join)
+## compiled_star('hello')
+#. ('hello',)
+
+## compile(~match(r'h(e)') + match(r'(.)'))('xhello')
+#. ('x',)
+## compile(capture(literal('a') | 'b') + position)('bc')
+#. ('b', 1)
+
+## catch_position(compile(literal('x').star() + end), 'xxxhi')
+#. 3
+
+compiled_nums = Grammar(r"""
+main : nums !/./.
+nums : num ** ','.
+num  : /([0-9]+)/ :int.
+""").compile({})
+## compiled_nums.main('10,30,43')
+#. (10, 30, 43)
+## compiled_nums.main.attempt('10,30,43 xxx')
+
+compiled_test3 = test3_grammar.compile(globals()).start.expecting_one_result()
+## compiled_test3('\\M . (\\f . M (f f)) (\\f . M (f f))')
+#. '(lambda (M) ((lambda (f) (M (f f))) (lambda (f) (M (f f)))))'
+## compiled_test3.attempt('(when (in the)')
+
+## count_word_calls(shared_prefix.compile(globals(), packrat=True), 'hi?')
+#. (('hi',), 1)
+
+
+# Smoke test: repetition doesn't use up the Python stack
+
+## (literal('x').star() + end)('x' * 100000)
+#. ()
+## (literal('x').plus() + end)('x' * 100000)
+#. ()
+## (star(literal('x'), literal(',')) + end)(','.join(['x'] * 100000))
+#. ()
+## (plus(literal('x'), literal(',')) + end)(','.join(['x'] * 100000))
+#. ()
+## len(nums.nums(','.join(['1'] * 5000)))
+#. 5000
+
+
+# Smoke test: pegs defined by the older run() interface still work
+
+from parson import _Peg
+
+def run_two_of_anything(s, far, (i, vals)):
+    if len(s) < i+2: return []
+    far[0] = max(far[0], i+2)
+    return [(i+2, vals + (s[i:i+2],))]
+two_of_anything = _Peg('two', run_two_of_anything)
+
+## (two_of_anything + match(r'(.)')).star()('abcdef')
+#. ('ab', 'c', 'de', 'f')
+## catch_position(two_of_anything + two_of_anything + 'x', 'abcdy')
+#. 4
+## compile(two_of_anything + 'c')('abc')
+#. ('ab',)
+## two_of_anything.run('abc', [0], (0, ()))
+#. [(2, ('ab',))]
+## (literal('ab') + position).run('abc', [0], (0, ('x',)))
+#. [(2, ('x', 2))]
+
+
+# Smoke test: collecting values takes linear time
+
+## len((match(r'(.)').star() >> join)('x' * 200000)[0])
+#. 200000
+## len(compile(match(r'(.)').star() >> join)('x' * 200000)[0])
+#. 200000
+
+# Backtracking undoes an alter() of values from before the choice:
+## (push('x') + (match(r'(a)') + alter(lambda *xs: ()) + 'b' | match(r'(a)c')))('ac')
+#. ('x', 'a')
+## compile(push('x') + (match(r'(a)') + alter(lambda *xs: ()) + 'b' | match(r'(a)c')))('ac')
+#. ('x', 'a')
+
+
+# Smoke test: either() looks at the next item to pick alternatives
+
+from parson import _first
+
+## sorted(_first(literal('if') | match(r'[0-9]+') | 'while')[0])
+#. ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'i', 'w']
+## _first(match(r'.') | 'y')
+#. (None, False)
+## _first(maybe(literal('a')) + 'b')
+#. (set(['a', 'b']), False)
+
+keyword_or_name = (literal('if') + push('if') | literal('else') + push('else')
+                   | match(r'([a-z]+)') | match(r'(\d+)') | match(r'(.?)'))
+
+## keyword_or_name('if'), keyword_or_name('ifs'), keyword_or_name('42')
+#. (('if',), ('if',), ('42',))
+## keyword_or_name(''), keyword_or_name('+')
+#. (('',), ('+',))
+## compile(keyword_or_name)('else'), compile(keyword_or_name)('')
+#. (('else',), ('',))
+## catch_position(literal('ab') + 'c' | literal('ab') + 'd' | 'x', 'abz')
+#. 2
+## catch_position(compile(literal('ab') + 'c' | literal('ab') + 'd' | 'x'), 'abz')
+#. 2
+## (one_of(1) + push('one') | one_of(2) + push('two') | anyone)([2])
+#. ('two',)
+## (one_of(1) + push('one') | anyone + push('any'))([[1]])
+#. ('any',)
+
+# Past ASCII, a regex's char is chr() in a str subject and unichr() in
+# a unicode one; dispatch must not pick just one.
+## (match(u'(\xe9)') | match(u'(x)')).attempt(u'\xe9')
+#. (u'\xe9',)
+## (match(r'([\x80-\xff])') | 'x').attempt(u'\xe9'), (match(r'([\x80-\xff])') | 'x').attempt('\xe9')
+#. ((u'\xe9',), ('\xe9',))
+## compile(match(u'(\xe9)') | match(u'(x)')).attempt(u'\xe9')
+#. (u'\xe9',)
+## _first(match(u'\xe9') | 'x')
+#. (None, False)
+
+# So too for a literal str, as if it were a regex: it matches either.
+## (literal('\xe9') | 'x').attempt(u'\xe9'), (literal('\xe9') | 'x').attempt('\xe9')
+#. ((), ())
+## compile(literal('a\xe9') + end).attempt(u'a\xe9'), literal('\xe9').attempt(u'e')
+#. ((), None)
+## _first(literal('\xe9') | 'x')
+#. (None, False)
+
+
+# Smoke test: Grammar fuses runs of literals and matches into one regex
+
+fused_g = Grammar(r"""
+stmt:    'if' expr 'then' stmt 'else' stmt
+      |  'print' expr.
+expr:    /(\d+)/ | '(' expr ')'.
+FNORD   ~= /\s*/.
+""")()
+
+## fused_g.stmt('if (1) then print 2 else print 3')
+#. ('1', '2', '3')
+## catch_position(fused_g.stmt, 'if (1) then print 2 els print 3')
+#. 20
+## catch_position(fused_g.stmt, 'if (1 then print 2')
+#. 6
+
+# Still PEG semantics: no backtracking into a regex, and ordered choice.
+fused_g2 = Grammar(r"""
+x:  'a' /b*/ 'b'.
+y:  {('a' | 'ab') 'b'}.
+z:  {'a' ('b' | 'bc') 'c'}.
+""")()
+
+## fused_g2.x.attempt('abb'), fused_g2.y('abb'), fused_g2.z('abcc')
+#. (None, ('ab',), ('abc',))
+
+# Fusing looks through rule references, but not into a delay() from
+# the subs, which stays unforced till the grammar's bound:
+thunked = []
+x_later = delay(lambda: thunked.append('x') or literal('x'), 'x_later')
+## Grammar(r"a: '(' :x_later ')' :end.").bind(dict(x_later=x_later)).a('(x)'), thunked
+#. ((), ['x'])
+
+
+# Smoke test: parsed grammars are cached on disk
+
+import os, parson, shutil, tempfile
+
+def cached_grammar_test(*texts):
+    "Parse each text twice with a fresh cache; list the cache files."
+    saved, parson.grammar_cache_dir = parson.grammar_cache_dir, tempfile.mkdtemp()
+    try:
+        for text in texts:
+            assert Grammar(text).skeletons == Grammar(text).skeletons
+        return Grammar(texts[0])().x('bbbbaa'), len(os.listdir(parson.grammar_cache_dir))
+    finally:
+        shutil.rmtree(parson.grammar_cache_dir)
+        parson.grammar_cache_dir = saved
+
+cached_text = r"""x = {/b+/} 'a'* :hug."""
+## cached_grammar_test(cached_text)
+#. ((('bbbb',),), 1)
+## cached_grammar_test(cached_text, cached_text + ' y = x.')
+#. ((('bbbb',),), 2)
+
+def edited_code_test(text):
+    "Parse text with a fresh cache, before and after parson's code changes."
+    saved = parson.grammar_cache_dir, parson._code_digest
+    parson.grammar_cache_dir = tempfile.mkdtemp()
+    try:
+        Grammar(text)
+        parson._code_digest = 'edited'
+        Grammar(text)
+        return len(os.listdir(parson.grammar_cache_dir))
+    finally:
+        shutil.rmtree(parson.grammar_cache_dir)
+        parson.grammar_cache_dir, parson._code_digest = saved
+
+## edited_code_test(cached_text)
+#. 2
+
+
+# Smoke test: a bound grammar's labels and rule references cost no
+# extra calls: each has the go() of the peg it stands for.
+
+linked_g = Grammar(r"""x = 'a' | y 'b'.  y = 'c' x?.""")()
+linked_ref = linked_g.y.args[0].args[1].args[0].args[0]
+
+## linked_ref, linked_ref.op, linked_ref.go is linked_g.x.go
+#. (x, 'delay', True)
+## linked_g.x.go is linked_g.x.args[0].go, linked_g.x.args[0].op
+#. (True, 'either')
+## linked_g.x('cab'), repr(linked_g.y)
+#. ((), 'y')
+
+
+# Smoke test: optimize() simplifies pegs and says how
+
+from parson import optimize
+
+def optimize_test(peg, subject):
+    counts = {}
+    optimized = optimize(peg, counts)
+    assert optimized(subject) == peg(subject)
+    assert compile(optimized)(subject) == peg(subject)
+    return optimized, optimized.op, sorted(counts.items())
+
+## optimize_test(literal('a') + empty + match(r'(b)'), 'ab')
+#. ((literal('a') /(b)/), 'chain', [('p + empty => p', 1)])
+## optimize_test(reduce(lambda q, r: either(r, q), [literal('x'), literal('y')], fail), 'x')[1:]
+#. ('either', [('p | fail => p', 1)])
+## optimize_test(maybe(maybe(literal('x'))), 'y')[1:]
+#. ('label', [('label(label(p)) => label(p)', 1), ('p | q => p, when p never fails', 1)])
+## optimize_test(seclude(seclude(literal('x') + match(r'(y)')) >> join) + push(1), 'xy')
+#. ((([(literal('x') /(y)/)]>>join) push(1)), 'chain', [('[[p]] => [p]', 1), ('[p :fn] => fed(p, fn)', 1)])
+## optimize_test(seclude(literal('x')).star(), 'xxx')[1:]
+#. ('star', [('[p] => p, when p has no values', 1)])
+
+# It follows rule references, and leaves them working the same:
+optimizable = Grammar(r"""
+list:  '(' item* ')' :hug.
+item:  list | /(\w+)/ [].
+FNORD ~= /\s*/.
+""")()
+## optimize_test(optimizable.list, '(a (b c) ())')[1:]
+#. ('label', [('[p :fn] => fed(p, fn)', 1), ('[p] => p, when p has no values', 1), ('p + empty => p', 1)])
+
+
+# Smoke test: walking the structure of pegs
+
+from parson import parts, walk
+
+## parts(literal('x') + match(r'(y)'))
+#. ('chain', (literal('x'), /(y)/), ())
+## parts(match(r'(y)')), parts(feed(join))[2] == (join,), parts(empty)
+#. (('match', (), ('(y)',)), True, ('label', (!(fail),), ()))
+## [p.op for p in walk(nums.nums)]
+#. ['label', 'seclude', 'label', 'label', 'either', 'chain', 'delay', 'label', 'seclude', 'chain', 'match', 'feed', 'star', 'chain', 'literal', 'label', 'invert', 'fail']
+## sorted(set(p.op for p in walk(Grammar(r"x = 'a' x | y. y = /b/ :hug.")().x)))
+#. ['chain', 'delay', 'either', 'feed', 'label', 'literal', 'match']
+
+
+# Smoke test: parsing a memory-mapped file or a buffer, without copying
+
+import mmap, tempfile
+from eg_json import json_parse
+
+def mapped(text):
+    f = tempfile.TemporaryFile()
+    f.write(text)
+    f.flush()
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+## json_parse(mapped('[1, {"a": [true, "x"]}, null]'))
+#. ((1.0, {'a': (True, 'x')}, None),)
+## [type(x).__name__ for x in capture(literal('ab') + match(r'c+'))(mapped('abccd'))]
+#. ['buffer']
+## str(capture(literal('ab') + match(r'c+'))(buffer('xabccd', 1))[0])
+#. 'abcc'
+## map(str, parson.exceptionally(lambda: (literal('ab') + literal('d'))(mapped('abc'))).failure)
+#. ['ab', 'c']
+
+# A memoryview works too, but not with regexes: Python 2's re can't
+# search one. (buffer() serves the same end.)
+## (literal('a') + one_of('bc').star())(memoryview('abcb'))
+#. ()
+
+
+# Smoke test: spans of the results of actions
+
+from parson import Spans
+
+spans = Spans()
+sums_grammar = Grammar(r"""
+exp:  term ('+' term :Add)*.
+term: /(\d+)/ :int | '(' exp ')'.
+FNORD ~= /\s*/.
+""")
+sums_subs = dict(Add=lambda x, y: ['Add', x, y])
+sums = sums_grammar.bind(sums_subs, spans=spans)
+
+def spanned(text, tree):
+    "Show each non-leaf of tree with the text of its span."
+    if not isinstance(tree, list): return tree
+    start, end = spans[tree]
+    return [text[start:end]] + [spanned(text, t) for t in tree[1:]]
+
+## spanned('1 + (2+ 3) + 4', sums.exp('1 + (2+ 3) + 4')[0])
+#. ['1 + (2+ 3) + 4', ['1 + (2+ 3) ', 1, ['2+ 3', 2, 3]], 4]
+## len(spans), spans.get('nope')
+#. (7, None)
+## spans.clear(); len(spans)
+#. 0
+
+# Compiled, the same:
+## spanned('(1+2) + 3', sums_grammar.compile(sums_subs, spans=spans).exp('(1+2) + 3')[0])
+#. ['(1+2) + 3', ['1+2', 1, 2], 3]
+
+# An = rule's actions span from the start of its body, though they
+# take their caller's values too:
+plus_grammar = Grammar(r"""
+sum:   '(' plus ')' :hug.
+plus = /(\d+)/ '+' /(\d+)/ :Add.
+""")
+## pluses = plus_grammar.bind(sums_subs, spans=spans); spans.clear()
+## spanned('12+3', pluses.plus('12+3')[0]), spanned('(1+2)', pluses.sum('(1+2)')[0][0])
+#. (['12+3', '12', '3'], ['1+2', '1', '2'])
+## spanned('7+8', compile(pluses.plus)('7+8')[0])
+#. ['7+8', '7', '8']
+
+
+# Smoke test: profiling a grammar's rules
+
+import itertools, operator
+from parson import Profile
+
+# (A clock that ticks once per reading, to make the times repeatable.)
+profile = Profile(timer=itertools.count().next)
+profiled_sums = sums_grammar.bind(dict(Add=operator.add), profile=profile)
+
+## profiled_sums.exp('(1+2) + x')
+#. (3,)
+## print profile.report()
+#. rule                    calls  succeed     fail   consumed    incl ms    excl ms
+#. term                        4        3        1          8  12000.000   7000.000
+#. exp                         2        2        0          9  15000.000   6000.000
+#. FNORD                       2        2        0          0   2000.000   2000.000
+## print profile.folded(),
+#. exp 3000000
+#. exp;term 3000000
+#. exp;term;exp 3000000
+#. exp;term;exp;term 4000000
+#. exp;term;exp;term;FNORD 2000000
+## profile.clear(); profile.folded(), profile.rules['exp'].calls
+#. ('', 0)
+
+# Rules named like the profiler's hooks don't get in their way:
+hooky = Grammar(r"'' enter* :end. enter: /(a)/. leave: 'b'.")
+## list(hooky.bind({}, profile=profile).iterparse('aaa')), profile.rules['enter'].calls
+#. (['a', 'a', 'a'], 4)
+
+
+# Smoke test: finding where a grammar backtracks
+
+from parson import Backtracking
+
+# This grammar parses every term up to three times over:
+redundant = Grammar(r"""
+exp:  term '+' exp :add | term '-' exp :sub | term.
+term: /(\d+)/ :int | '(' exp ')'.
+FNORD ~= /\s*/.
+""")
+redundant_subs = dict(add=operator.add, sub=operator.sub)
+
+backtracking = Backtracking()
+## redundant.bind(redundant_subs, backtracking=backtracking).exp('((1+2)+(3+4)) + x')
+#. (10,)
+## print backtracking.report()
+#. place                   tries  retries     fail     wasted  alternative
+#. exp|1                      31       24       16         43  (term ((literal('+') FNORD) (exp :<bu...
+#. exp|2                      16       12       16         41  (term ((literal('-') FNORD) (exp :<bu...
+#. FNORD                      48       44        0          0
+#. exp                        32       24        1          0
+#. exp|3                      16       12        0          0  term
+#. term                       63       56        0          0
+#. term|1                     48       44        0          0  ((/(\d+)/ FNORD) :<type 'int'>)
+#. term|2                     15       12        0          0  ((literal('(') FNORD) (exp (literal('...
+
+# With packrat parsing, the retries are gone, but not the waste:
+## backtracking.clear(); redundant.bind(redundant_subs, packrat=True, backtracking=backtracking).exp('((1+2)+(3+4)) + x')
+#. (10,)
+## print backtracking.report()
+#. place                   tries  retries     fail     wasted  alternative
+#. exp|1                       7        0        4         23  (term ((literal('+') FNORD) (exp :<bu...
+#. exp|2                       4        0        4         21  (term ((literal('-') FNORD) (exp :<bu...
+#. FNORD                       4        0        0          0
+#. exp                         8        0        1          0
+#. exp|3                       4        0        0          0  term
+#. term                        7        0        0          0
+#. term|1                      4        0        0          0  ((/(\d+)/ FNORD) :<type 'int'>)
+#. term|2                      3        0        0          0  ((literal('(') FNORD) (exp (literal('...
+
+
+# Smoke test: running pegs on pegvm's machine, with vm()
+
+import pegvm
+
+nested_g = Grammar(r"""
+nested :  '(' nested ')' :wrap | /(\w*)/.
+""")(wrap=lambda x: '<%s>' % x)
+
+## pegvm.vm(nested_g.nested)('((ab))')
+#. ('<<ab>>',)
+## pegvm.vm(nested_g.nested + end).attempt('((ab)')
+## pegvm.vm(literal('\xe9') + end).attempt(u'\xe9')
+#. ()
+
+# Deep enough to overflow the Python stack, run the usual way:
+## len(pegvm.vm(nested_g.nested)('(' * 10000 + 'x' + ')' * 10000)[0])
+#. 20001
+
+## len(pegvm.vm(json_parse.value)('[' * 10000 + ']' * 10000))
+#. 1
+
+## exceptionally(lambda: pegvm.vm(json_parse.value)('[1, {"a" 2}]')).failure
+#. ('[1, {"a" ', '2}]')
+
+## pegvm.vm(nest(one_of(1) + one_of(2)) + one_of(5))([[1, 2], 5])
+#. ()
+## pegvm.vm(capture(star(nest(one_of('a')))))(['a', 'a', 'b'])
+#. (['a', 'a'],)
+
+# The subject can be any sequence, and we don't copy it as we go:
+## pegvm.vm(json_parse.value)(buffer('[1, "two", [true]]'))
+#. ((1.0, 'two', (True,)),)
+
+# Packrat parsing, and forgetting what we won't need again:
+records_grammar = Grammar(r"""
+records :  record* :end.
+record  :  name '=' /(\d+)/ ';' :hug.
+name    :  /(\w+)/.
+""")
+records_g = records_grammar.bind({}, packrat=True)
+
+## cx = parson._Parse(); pegvm.vm(records_g.records).go('a=1;' * 1000, 0, cx)
+#. 4000
+## sorted(len(table) for table in cx.memos.values())
+#. [1, 1]
+## pegvm.vm(records_g.records)('a=1;bc=23;')
+#. (('a', '1'), ('bc', '23'))
+## pegvm.vm(records_g.records + end).attempt('a=1;b=')
+
+# Without packrat parsing this would take time exponential in the depth:
+backtracky_g = Grammar(r"""
+a :  b 'x' | b 'y' | b.
+b :  '(' a ')' | 'z'.
+""").bind({}, packrat=True)
+
+## pegvm.vm(backtracky_g.a)('(' * 3000 + 'z' + ')' * 3000)
+#. ()
+
+
+
+# Smoke test: push parsing with a Feeder, a chunk at a time
+
+def fed(peg, chunks):
+    "Return a feeder for peg, fed the chunks."
+    feeder = peg.feeder()
+    for chunk in chunks: feeder.feed(chunk)
+    return feeder
+
+## fed(json_parse.value, '[1, {"a": [true, "x"]}, null]').close()
+#. ((1.0, {'a': (True, 'x')}, None),)
+
+# We keep only the input from the record in progress on:
+## f = fed(records_g.records, ('k%d=%d;' % (k, k) for k in range(1000)))
+## f.offset, f.buffer
+#. (8780, '')
+## f.feed('k1000='); f.buffer
+#. []
+#. 'k1000='
+## f.close()[-1]
+#. EXC Unparsable: (records, 'k1000=', '')
+## f = records_g.records.feeder()
+## f.feed('a=1;b=2;c'); f.buffer
+#. []
+#. 'c'
+## e = exceptionally(lambda: f.feed('=x;'))
+## e.failure, e.position, f.offset, e.offset
+#. (('c=', 'x;'), 10, 8, 8)
+
+# and the line and column count the lines of the input let go of too:
+## f = fed(star(match(r'\s*(\w+)')) + end, ['a b\nc', ' d\ne', ' f'])
+## e = exceptionally(lambda: f.feed(' g!'))
+## f.offset, f.buffer, e.position, e.line, e.column
+#. (13, '!', 13, 3, 5)
+
+# Inside a rule call we can't drop input, so once the input held gets
+# big, new chunks wait to be added (and copied) all at once:
+quoted = Grammar(r"""'' value :end.  value: '[' /"([^"]*)"/ ']'.""")()
+## f = fed(quoted, ['["' + 'x' * 20000, 'x' * 100, 'x' * 100])
+## len(f.buffer), f.held_size
+#. (20002, 200)
+## f.feed('"]'); len(f.close()[0])
+#. []
+#. 20200
+
+# A regex that might go on matching waits for more input:
+## f = fed(match(r'(a*)') + match(r'(b|bc)d'), ['aa'])
+## f.suspended is not None
+#. True
+## f.feed('bc'); f.feed('d'); f.close()
+#. []
+#. []
+#. ('aa', 'bc')
+
+# position counts the input we've let go of:
+## words = star(match(r'\s*(\w+)') + position)
+## fed(words, ['one tw', 'o', ' three ', 'four']).close()
+#. ('one', 3, 'two', 7, 'three', 13, 'four', 18)
+
+# Streaming the values of the outermost repetition as they settle:
+## f = pegvm.Feeder(records_g.records, streaming=True)
+## f.feed('a=1;b=2;c'), f.feed('=3'), f.feed(';'), f.close()
+#. ([('a', '1'), ('b', '2')], [], [('c', '3')], ())
+## list(pegvm.stream(json_parse.array, ['[1, 2', ', [3', ', 4]', ', {"a": 5}]']))
+#. [1.0, 2.0, (3.0, 4.0), {'a': 5.0}]
+## list(pegvm.stream(plus(match('(a)')), 'aaa'))
+#. ['a', 'a', 'a']
+## pegvm.Feeder(literal('x') + end, streaming=True)
+#. EXC ValueError: ('No repetition to stream', (literal('x') end))
+
+
+
+# Smoke test: iterparsing a whole sequence, item by item
+
+## list(records_g.records.iterparse('a=1;b=2;'))
+#. [('a', '1'), ('b', '2')]
+## items = json_parse.array.iterparse('[1, [2], x]')
+## next(items), next(items)
+#. (1.0, (2.0,))
+## next(items)
+#. EXC Unparsable: (array, '[1, [2], ', 'x]')
+## lines = Grammar(r"'' line* :end.  line: /([^\n]*)\n/.").iterparse(None, {})
+## list(lines('one\ntwo\n'))
+#. ['one', 'two']
+
+# A profiled grammar runs on the machine too, and still streams:
+records_profile = Profile()
+## items = records_grammar.iterparse('records', {}, profile=records_profile)('a=1;bc=23;d')
+## next(items), [(name, st.calls) for name, st in sorted(records_profile.rules.items())]
+#. (('a', '1'), [('name', 1), ('record', 1), ('records', 1)])
+## next(items)
+#. ('bc', '23')
+## next(items)
+#. EXC Unparsable: (records, 'a=1;bc=23;d', '')
+## [(name, st.calls, st.failures, st.consumed) for name, st in sorted(records_profile.rules.items())]
+#. [('name', 3, 0, 4), ('record', 3, 1, 10), ('records', 1, 1, 0)]
+## records_profile.clear(); pegvm.vm(records_grammar.bind({}, profile=records_profile).records)('a=1;' * 5000)[-1]
+#. ('a', '1')
+## records_profile.rules['record'].calls, len(records_profile.frames)
+#. (5001, 1)
+
+# And so does one watched for backtracking, in the p**sep form too:
+listing_grammar = Grammar(r"""
+listing :  item**',' :end.
+item    :  /(\w+)/ | /(\d+)/ '#'.
+""")
+listing_backtracking = Backtracking()
+## items = listing_grammar.iterparse('listing', {}, backtracking=listing_backtracking)('a,b,c')
+## next(items), next(items)
+#. ('a', 'b')
+## list(items)
+#. ['c']
+## [(place, st.tries, st.failures) for place, st in sorted(listing_backtracking.places.items())]
+#. [('item', 3, 0), ('item|1', 3, 0), ('item|2', 0, 0), ('listing', 1, 0), ('listing|1', 1, 0), ('listing|2', 0, 0)]
+
+
+# Smoke test: streaming from a socket
+
+import socket, threading
+
+# A stand-in for a stream server on the network:
+def served(chunks):
+    """Return a socket connected to a thread that sends it the chunks,
+    one send() apiece, then hangs up."""
+    ours, theirs = socket.socketpair()
+    def serve():
+        for chunk in chunks: theirs.sendall(chunk)
+        theirs.close()
+    server = threading.Thread(target=serve)
+    server.daemon = True
+    server.start()
+    return ours
+
+def received(sock, size=4096):
+    "Return an iterator over the chunks sock receives."
+    return iter(lambda: sock.recv(size), '')
+
+## values = pegvm.stream(records_g.records, received(served('k%d=%d;' % (k, k) for k in range(5000)), 64))
+## sum(1 for _ in values)
+#. 5000
+
+# A value comes out as soon as its input is in, not at the end:
+## ours, theirs = socket.socketpair()
+## values = pegvm.stream(records_g.records, received(ours))
+## theirs.sendall('a=1;b=')
+## next(values)
+#. ('a', '1')
+## theirs.sendall('2;'); theirs.close()
+## list(values)
+#. [('b', '2')]